@@ -0,0 +1,234 @@
+"""Time the viewer's hot paths on synthetic exports and write the results as JSON.
+
+Examples:
+    python scripts/benchmark.py --messages 200000 --output bench_results.json
+    python scripts/benchmark.py --messages 200000 --compare bench_results.json
+    python scripts/benchmark.py --export exports/MyChat.zip
+
+Everything runs in a temporary directory; the real exports/ and .cache/ are not touched.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zipfile
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import whatsapp_export_viewer as viewer  # noqa: E402
+from generate_export import generate_export  # noqa: E402
+
+SEARCH_QUERIES = ('ok', 'the', 'tickets booked', 'café', 'zzzz')
+
+
+class QuietHandler(viewer.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(fn, repeat=1):
+    """Run fn repeat times; return (summary dict, last result)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times), result
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'runs': len(times),
+        'min_s': times[0],
+        'median_s': statistics.median(times),
+        'mean_s': statistics.mean(times),
+        'p95_s': times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))],
+        'max_s': times[-1],
+    }
+
+
+def reset_viewer(cache_dir):
+    """Forget every in-memory and on-disk cache so the next load is cold"""
+    viewer.CHAT_STORE.clear()
+    viewer._zip_hashes.clear()
+    viewer._zip_members.clear()
+    viewer.FRAGMENT_CACHE.clear()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+
+
+def bench_export(zip_path, workdir, repeat, api_requests):
+    results = {}
+    cache_dir = viewer.CACHE_DIR
+
+    # parse_chat_streaming on an already extracted chat (extraction itself is not timed)
+    extract_dir = os.path.join(workdir, 'extracted')
+    shutil.rmtree(extract_dir, ignore_errors=True)
+    with zipfile.ZipFile(zip_path) as zf:
+        zf.extractall(extract_dir)
+    chat_file = viewer.find_chat_file_in_dir(extract_dir)
+    chat_dir = os.path.dirname(chat_file)
+    results['parse_chat_streaming'], count = timed(
+        lambda: sum(1 for _ in viewer.parse_chat_streaming(chat_file, chat_dir)), repeat)
+    results['parse_chat_streaming']['messages'] = count
+    shutil.rmtree(extract_dir)
+
+    # extract_and_parse: cold (nothing cached), then warm (served from memory)
+    cold = []
+    for _ in range(repeat):
+        reset_viewer(cache_dir)
+        stats, messages = timed(lambda: viewer.extract_and_parse(zip_path))
+        cold.append(stats['min_s'])
+    results['extract_and_parse_cold'] = summarize(cold)
+    results['extract_and_parse_warm'], _ = timed(lambda: viewer.extract_and_parse(zip_path), repeat * 20)
+
+    # Loading the on-disk cache after a restart, and reading one page from it
+    def load_from_disk():
+        viewer.CHAT_STORE.clear()
+        chat = viewer.load_chat(zip_path)
+        return chat.messages[:viewer.BATCH_SIZE]
+    results['cache_load'], _ = timed(load_from_disk, repeat)
+
+    # Search: the first run of a query pays for loading the index; repeats hit the result cache
+    chat = viewer.load_chat(zip_path)
+    for q in SEARCH_QUERIES:
+        def search_cold(q=q):
+            chat._search_results.clear()
+            return chat.find_matches(q)
+        stats, matches = timed(search_cold, repeat)
+        stats['matches'] = len(matches)
+        results[f'search[{q}]'] = stats
+
+    # Rendering a page, with and without highlighting
+    total = len(chat.messages)
+    for batch_size in (50, 500):
+        start = max(0, total // 2 - batch_size // 2)
+        page = []
+        for i in range(start, min(total, start + batch_size)):
+            msg = dict(chat.messages[i])
+            msg['_index'] = i
+            page.append(msg)
+        results[f'render[{batch_size}]'], _ = timed(
+            lambda: viewer.render_message_html_with_highlight(page, ''), repeat * 5)
+        results[f'render[{batch_size},query]'], _ = timed(
+            lambda: viewer.render_message_html_with_highlight(page, 'the'), repeat * 5)
+
+    # End-to-end /api/messages latency over HTTP
+    server = viewer.ThreadingServer(('127.0.0.1', 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}/api/messages?file={os.path.basename(zip_path)}'
+    pages = max(1, total // viewer.BATCH_SIZE)
+    try:
+        for label, extra in (('api_messages', ''), ('api_messages[query]', '&query=the')):
+            times = []
+            for n in range(api_requests):
+                url = f'{base}&page={(n * 7919) % pages}{extra}'
+                start = time.perf_counter()
+                with urllib.request.urlopen(url) as resp:
+                    resp.read()
+                times.append(time.perf_counter() - start)
+            results[label] = summarize(times)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report, baseline=None):
+    for export, results in report['results'].items():
+        print(f'\n{export}')
+        for name, stats in results.items():
+            line = f"  {name:<28} median {stats['median_s'] * 1000:10.2f} ms   p95 {stats['p95_s'] * 1000:10.2f} ms"
+            old = (baseline or {}).get('results', {}).get(export, {}).get(name)
+            if old and old['median_s']:
+                line += f"   x{stats['median_s'] / old['median_s']:.2f} vs baseline"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100000, help='messages per generated export')
+    parser.add_argument('--media', type=int, default=2000, help='media files per generated export')
+    parser.add_argument('--dialects', nargs='+', choices=('ios', 'android'), default=['ios', 'android'])
+    parser.add_argument('--export', action='append', default=[],
+                        help='benchmark an existing ZIP instead of generating one (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    parser.add_argument('--api-requests', type=int, default=50, help='HTTP requests per /api/messages run')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='print ratios against an earlier results file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary working directory')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='wa_bench_')
+    viewer.EXPORTS_DIR = os.path.join(workdir, 'exports')
+    viewer.CACHE_DIR = os.path.join(workdir, 'cache')
+    os.makedirs(viewer.EXPORTS_DIR)
+    os.makedirs(viewer.CACHE_DIR)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': {},
+    }
+    try:
+        exports = []
+        for path in args.export:
+            target = os.path.join(viewer.EXPORTS_DIR, os.path.basename(path))
+            shutil.copy(path, target)
+            exports.append((os.path.basename(path), target))
+        if not args.export:
+            for dialect in args.dialects:
+                target = os.path.join(viewer.EXPORTS_DIR, f'bench_{dialect}.zip')
+                print(f'Generating {dialect} export with {args.messages} messages...')
+                generate_export(target, messages=args.messages, media=args.media, dialect=dialect)
+                exports.append((f'{dialect}-{args.messages}', target))
+
+        for label, zip_path in exports:
+            print(f'Benchmarking {label}...')
+            report['results'][label] = bench_export(zip_path, workdir, args.repeat, args.api_requests)
+    finally:
+        if args.keep:
+            print(f'Working directory kept at {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,90 @@
 import importlib.util
 import sys
 import os
+import tempfile
+import zipfile
 from importlib.machinery import SourceFileLoader
 
-script_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Qwen_python_20251024_9n7pvuwta.py'))
+script_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'whatsapp_export_viewer.py'))
 loader = SourceFileLoader('whats_module', script_path)
 mod = loader.load_module()
 
-exports_dir = os.path.join(os.path.dirname(script_path), 'exports')
-# choose first zip
-zips = [f for f in os.listdir(exports_dir) if f.lower().endswith('.zip')]
-if not zips:
-    print('No zip files found in', exports_dir)
-    sys.exit(1)
-zip_file = zips[0]
-zip_path = os.path.join(exports_dir, zip_file)
-print('Using zip:', zip_file)
-messages = mod.extract_and_parse(zip_path)
-print('Parsed messages:', len(messages))
-# print first 30 messages senders and is_system
-for i, m in enumerate(messages[:30], 1):
-    print(f"{i:02d}: sender={m.get('sender')!r}, is_system={m.get('is_system')}, text={m.get('text')[:60]!r}")
-# print unique senders
-senders = sorted({m['sender'] for m in messages if not m.get('is_system', False)})
-print('\nUnique senders (count={}):'.format(len(senders)))
-for s in senders:
-    print(' -', s)
+
+def check_parallel_parse(chat_path, media_index, chunk_sizes):
+    """The parallel parser must give exactly the serial parser's messages and fingerprint"""
+    serial_fp = mod.ChatFingerprint()
+    with open(chat_path, 'r', encoding='utf-8', errors='replace') as f:
+        serial = list(mod.parse_chat_lines(serial_fp.reading(f), mod.RecordingMediaIndex(media_index, serial_fp)))
+    for chunk_bytes in chunk_sizes:
+        parallel_fp = mod.ChatFingerprint()
+        parallel = list(mod.parse_chat_parallel(chat_path, media_index, parallel_fp, workers=2, chunk_bytes=chunk_bytes))
+        same_fp = all(getattr(serial_fp, a) == getattr(parallel_fp, a) for a in
+                      ('lines', 'head', 'checkpoints', 'digest', 'lookups', 'first_media', 'first_media_used'))
+        if parallel != serial or not same_fp:
+            print(f'Parallel parse differs from serial parse (chunk_bytes={chunk_bytes}, '
+                  f'{len(parallel)} vs {len(serial)} messages, fingerprint match: {same_fp})')
+            sys.exit(1)
+    print(f'Parallel parse matches serial parse ({len(serial)} messages, chunk sizes {chunk_sizes})')
+
+
+SAMPLE_CHAT = (
+    '\ufeffstray line before any message\r\n'
+    '[01/02/2023, 10:00:00] Alice: hello\r\n'
+    'second line of hello\r\n'
+    '\r\n'
+    'third line after a blank one\n'
+    '[01/02/2023, 10:01:00] Bob: <attached: 00000001-PHOTO-2023-02-01.jpg>\n'
+    '[01/02/2023, 10:02:00] Messages are end-to-end encrypted\n'
+    '01/02/2023, 10:03 - Carol: dash style \u202fwith odd spaces\n'
+    '[01/02/2023, 10:04:00] Alice: <Media omitted>\n'
+    '[01/02/2023, 10:05:00] Bob: bad bytes follow\n'
+)
+
+def check_sample_chat():
+    """Parallel vs serial on a generated chat full of multi-line messages, cut into chunks small
+    enough that messages cross chunk boundaries; needs no export"""
+    checkpoint_lines = mod.FINGERPRINT_CHECKPOINT_LINES
+    mod.FINGERPRINT_CHECKPOINT_LINES = 100
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            sample_path = os.path.join(tmp, 'sample.txt')
+            with open(sample_path, 'wb') as out:
+                for i in range(300):
+                    out.write(SAMPLE_CHAT.replace('Alice', f'Alice{i % 7}').encode('utf-8'))
+                    out.write(b'\xe2\x82 broken utf-8\n' + b'continued %d\n' % i * (i % 5))
+            sample_index = mod.MediaIndex(['media/00000001-PHOTO-2023-02-01.jpg', 'media/other.mp4'])
+            check_parallel_parse(sample_path, sample_index, [1, 97, 1000, 10 ** 9])
+    finally:
+        mod.FINGERPRINT_CHECKPOINT_LINES = checkpoint_lines
+
+
+if __name__ == '__main__':
+    check_sample_chat()
+
+    exports_dir = os.path.join(os.path.dirname(script_path), 'exports')
+    # choose first zip
+    zips = [f for f in os.listdir(exports_dir) if f.lower().endswith('.zip')] if os.path.isdir(exports_dir) else []
+    if not zips:
+        print('No zip files found in', exports_dir, '- skipping the checks on a real export')
+        sys.exit(0)
+    zip_file = zips[0]
+    zip_path = os.path.join(exports_dir, zip_file)
+    print('Using zip:', zip_file)
+    messages = mod.extract_and_parse(zip_path)
+    print('Parsed messages:', len(messages))
+    # print first 30 messages senders and is_system
+    for i, m in enumerate(messages[:30], 1):
+        print(f"{i:02d}: sender={m.get('sender')!r}, is_system={m.get('is_system')}, text={m.get('text')[:60]!r}")
+    # print unique senders
+    senders = sorted({m['sender'] for m in messages if not m.get('is_system', False)})
+    print('\nUnique senders (count={}):'.format(len(senders)))
+    for s in senders:
+        print(' -', s)
+
+    # Parallel parsing of this export's chat, in chunks small enough to split messages
+    members = mod.get_zip_members(zip_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        chat_path = os.path.join(tmp, 'chat.txt')
+        with zipfile.ZipFile(zip_path) as zf, open(chat_path, 'wb') as out:
+            out.write(zf.read(members.chat_member))
+        check_parallel_parse(chat_path, members.media_index(), [4096, 64 * 1024])
@@ -22,6 +22,14 @@ try {
     window.scrollLoadThresholdRatio = 0.18; // or within this fraction of total height
     window.scrollLoadDebounceMs = 120; // debounce scroll handler to avoid flurry of calls
     window._scrollDebounceTimer = null;
+    // Windowed rendering: only this many pages keep their messages in the DOM; pages
+    // scrolled further than recycleDistanceScreens viewports away become empty spacers
+    // of the same height and are fetched again when scrolled back into range
+    window.maxDomPages = 8;
+    window.recycleDistanceScreens = 2;
+    // While the server is still parsing a chat, pages that aren't ready yet are re-requested
+    window.ingestPollMs = 1000;
+    window.ingesting = false;
 // DOM Ready handler - setup event listeners
 document.addEventListener('DOMContentLoaded', () => {
     // Setup event listeners for controls
@@ -43,34 +51,37 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 function handleScroll(e) {
+    // The only scroll listener: debounce, then load, restore and recycle pages around the viewport
     const container = e.target;
-    
-    if (window.isLoading) {
-        // Don't initiate loads while a load is in progress
-        return;
-    }
-
-    // Debounce heavy scroll handling to avoid spamming loads while user scrolls fast
     if (window._scrollDebounceTimer) {
         clearTimeout(window._scrollDebounceTimer);
     }
-    window._scrollDebounceTimer = setTimeout(() => {
+    window._scrollDebounceTimer = setTimeout(() => updatePageWindow(container), window.scrollLoadDebounceMs);
+}
+
+function updatePageWindow(container) {
+    restoreNearbyPages(container);
+
+    if (!window.isLoading && window.loadedPages.size) {
+        const pages = Array.from(window.loadedPages);
         const remainingToBottom = container.scrollHeight - container.scrollTop - container.clientHeight;
         const ratioToBottom = remainingToBottom / Math.max(1, container.scrollHeight);
 
         const shouldLoadNext = (remainingToBottom <= window.scrollLoadThresholdPx) || (ratioToBottom <= window.scrollLoadThresholdRatio);
         if (shouldLoadNext) {
-            const nextPage = Math.max(...Array.from(window.loadedPages), 0) + 1;
-            if (!window.loadedPages.has(nextPage) && window.hasMoreMessages) {
-                loadPage(nextPage, document.getElementById('search-box').value, null, 'append');
+            const nextPage = Math.max(...pages) + 1;
+            if (window.hasMoreMessages) {
+                loadPage(nextPage, document.getElementById('search-box').value, null, 'append')
+                    .then(() => recycleDistantPages(container));
+                return;
             }
         }
 
         // previous (prepend) when near top
         const shouldLoadPrev = container.scrollTop <= window.scrollLoadThresholdPx || (container.scrollTop / Math.max(1, container.scrollHeight) <= window.scrollLoadThresholdRatio);
         if (shouldLoadPrev) {
-            const prevPage = Math.min(...Array.from(window.loadedPages), 0) - 1;
-            if (prevPage >= 0 && !window.loadedPages.has(prevPage)) {
+            const prevPage = Math.min(...pages) - 1;
+            if (prevPage >= 0) {
                 const oldScrollHeight = container.scrollHeight;
                 const oldScrollTop = container.scrollTop;
                 loadPage(prevPage, document.getElementById('search-box').value, null, 'prepend')
@@ -78,10 +89,87 @@ function handleScroll(e) {
                         // Maintain scroll position
                         const heightDiff = container.scrollHeight - oldScrollHeight;
                         container.scrollTop = oldScrollTop + heightDiff;
+                        recycleDistantPages(container);
                     });
+                return;
             }
         }
-    }, window.scrollLoadDebounceMs);
+    }
+    recycleDistantPages(container);
+}
+
+function distanceFromViewport(container, el) {
+    // Pixels between a page element and the visible part of the container (0 when on screen)
+    const view = container.getBoundingClientRect();
+    const rect = el.getBoundingClientRect();
+    if (rect.bottom < view.top) {
+        return view.top - rect.bottom;
+    }
+    if (rect.top > view.bottom) {
+        return rect.top - view.bottom;
+    }
+    return 0;
+}
+
+function recycleDistantPages(container) {
+    // Swap the rendered pages furthest from the viewport for spacers of the same height
+    const rendered = Array.from(container.querySelectorAll('.page:not(.recycled)'));
+    if (rendered.length <= window.maxDomPages) {
+        return;
+    }
+    const minDistance = container.clientHeight * window.recycleDistanceScreens;
+    const candidates = rendered
+        .map(el => ({el, distance: distanceFromViewport(container, el)}))
+        .filter(c => c.distance > minDistance)
+        .sort((a, b) => b.distance - a.distance)
+        .slice(0, rendered.length - window.maxDomPages);
+    candidates.forEach(({el}) => {
+        el.style.height = el.offsetHeight + 'px';
+        el.textContent = '';
+        el.classList.add('recycled');
+    });
+}
+
+function restoreNearbyPages(container) {
+    // Fetch the messages of spacers that have come back within range of the viewport
+    const maxDistance = container.clientHeight * window.recycleDistanceScreens;
+    container.querySelectorAll('.page.recycled').forEach(el => {
+        if (el.dataset.restoring || distanceFromViewport(container, el) > maxDistance) {
+            return;
+        }
+        el.dataset.restoring = '1';
+        const page = parseInt(el.dataset.page, 10);
+        fetch(messagesUrl(page, document.getElementById('search-box').value))
+            .then(res => res.json())
+            .then(data => {
+                delete el.dataset.restoring;
+                if (!el.isConnected || data.error) {
+                    return;
+                }
+                // Keep the view still if the restored page sits above it and changed height
+                const above = el.getBoundingClientRect().bottom <= container.getBoundingClientRect().top;
+                const oldHeight = el.offsetHeight;
+                el.innerHTML = data.html || '';
+                el.style.height = '';
+                el.classList.remove('recycled');
+                applyMessageAlignment(el);
+                if (above) {
+                    container.scrollTop += el.offsetHeight - oldHeight;
+                }
+            })
+            .catch(() => {
+                delete el.dataset.restoring;
+            });
+    });
+}
+
+function pageElement(page, html) {
+    // Each fetched page lives in its own wrapper so it can be recycled as a unit
+    const el = document.createElement('div');
+    el.className = 'page';
+    el.dataset.page = page;
+    el.innerHTML = html;
+    return el;
 }
 
 
@@ -111,73 +199,41 @@ function setupEventListeners() {
         }
     });
 
+    // Server-side filters and the search mode: any change starts again from the first page
+    ['search-mode', 'filter-sender', 'filter-type', 'filter-from', 'filter-to'].forEach(id => {
+        const el = document.getElementById(id);
+        if (el) {
+            el.addEventListener('change', reloadWithFilters);
+        }
+    });
+
     // Batch size changes
     document.getElementById('batch-size').addEventListener('change', function() {
         window.config.batchSize = parseInt(this.value, 10) || window.config.batchSize;
         loadPage(0, document.getElementById('search-box').value);
     });
+}
 
-    // Infinite scroll handling with scroll position preservation
-    document.getElementById('chat-container').addEventListener('scroll', function(e) {
-        const container = e.target;
-        
-        // Debug scroll information
-        console.log('Scroll event:', {
-            scrollHeight: container.scrollHeight,
-            scrollTop: container.scrollTop,
-            clientHeight: container.clientHeight,
-            remainingToBottom: container.scrollHeight - container.scrollTop - container.clientHeight,
-            loadedPages: Array.from(loadedPages),
-            isLoading: isLoading
-        });
-        
-        if (isLoading) {
-            console.log('Skip loading - already in progress');
-            return;
-        }
-        
-        // Load next batch if near bottom (200px threshold)
-        const remainingToBottom = container.scrollHeight - container.scrollTop - container.clientHeight;
-        if (remainingToBottom < 200) {
-            console.log('Near bottom, attempting to load next page');
-            const loadedPagesArray = Array.from(loadedPages);
-            if (loadedPagesArray.length === 0) {
-                console.log('No pages loaded yet, loading page 0');
-                loadPage(0, document.getElementById('search-box').value, null, 'append');
-                return;
-            }
-            
-            let nextPage = Math.max(...loadedPagesArray) + 1;
-            console.log('Next page to load:', nextPage);
-            if (!loadedPages.has(nextPage) && hasMoreMessages) {
-                console.log('Loading next page:', nextPage);
-                loadPage(nextPage, document.getElementById('search-box').value, null, 'append');
-            }
-        }
-        
-        // Load previous batch if near top (200px threshold)
-        if (container.scrollTop < 200) {
-            console.log('Near top, attempting to load previous page');
-            const loadedPagesArray = Array.from(loadedPages);
-            if (loadedPagesArray.length === 0) {
-                return;
-            }
-            
-            let prevPage = Math.min(...loadedPagesArray) - 1;
-            console.log('Previous page to load:', prevPage);
-            if (prevPage >= 0 && !loadedPages.has(prevPage)) {
-                const oldScrollHeight = container.scrollHeight;
-                const oldScrollTop = container.scrollTop;
-                loadPage(prevPage, document.getElementById('search-box').value, null, 'prepend')
-                    .then(() => {
-                        // Adjust scroll position to maintain the same view when prepending
-                        const newScrollHeight = container.scrollHeight;
-                        const heightDiff = newScrollHeight - oldScrollHeight;
-                        container.scrollTop = oldScrollTop + heightDiff;
-                    });
-            }
+function filterParams() {
+    // The header's search mode and filter controls as extra /api/messages query parameters
+    let params = '';
+    [['mode', 'search-mode'], ['sender', 'filter-sender'], ['type', 'filter-type'], ['from', 'filter-from'], ['to', 'filter-to']].forEach(([name, id]) => {
+        const el = document.getElementById(id);
+        if (el && el.value) {
+            params += `&${name}=${encodeURIComponent(el.value)}`;
         }
     });
+    return params;
+}
+
+function reloadWithFilters() {
+    window.loadedPages = new Set();
+    window.hasMoreMessages = true;
+    loadPage(0, document.getElementById('search-box').value);
+}
+
+function messagesUrl(page, query) {
+    return `/api/messages?page=${page}&query=${encodeURIComponent(query)}&file=${window.config.encodedFile}&batch_size=${window.config.batchSize}${filterParams()}`;
 }
 
 function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
@@ -208,8 +264,7 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
         container.insertBefore(loadingDiv, container.firstChild);
     }
     
-    const url = `/api/messages?page=${page}&query=${encodeURIComponent(query)}&file=${window.config.encodedFile}&batch_size=${window.config.batchSize}`;
-    return fetch(url)
+    return fetch(messagesUrl(page, query))
         .then(res => res.json())
         .then(data => {
             const container = document.getElementById('chat-container');
@@ -220,14 +275,32 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
                 isLoading = false;
                 return;
             }
+
+            window.ingesting = !!data.ingesting;
+            window.searchPartial = !!data.partial;
+            if (window.ingesting && !(data.html && data.html.trim())) {
+                // Page not parsed yet: keep hasMoreMessages and ask again shortly
+                renderPagination(page, data.total_matches);
+                const pendingIndicator = container.querySelector('.loading-indicator');
+                if (pendingIndicator) {
+                    pendingIndicator.remove();
+                }
+                window.isLoading = false;
+                setTimeout(() => loadPage(page, query, scrollToIndex, mode), window.ingestPollMs);
+                return;
+            }
             
+            let inserted = null;
             if (mode === 'replace') {
-                container.innerHTML = data.html;
+                inserted = pageElement(page, data.html);
+                container.innerHTML = '';
+                container.appendChild(inserted);
                 window.loadedPages = new Set([page]);
                 window.totalLoadedMessages = data.total_matches;
             } else if (mode === 'append') {
                 if (data.html && data.html.trim()) {
-                    container.insertAdjacentHTML('beforeend', data.html);
+                    inserted = pageElement(page, data.html);
+                    container.appendChild(inserted);
                     window.loadedPages.add(page);
                     window.totalLoadedMessages += window.config.batchSize;
                 } else {
@@ -235,7 +308,8 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
                 }
             } else if (mode === 'prepend') {
                 if (data.html && data.html.trim()) {
-                    container.insertAdjacentHTML('afterbegin', data.html);
+                    inserted = pageElement(page, data.html);
+                    container.insertBefore(inserted, container.querySelector('.page'));
                     window.loadedPages.add(page);
                     window.totalLoadedMessages += window.config.batchSize;
                 }
@@ -243,7 +317,9 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
             
             renderPagination(page, data.total_matches);
             populateSenderDropdown(data.senders || []);
-            applyMessageAlignment();
+            if (inserted) {
+                applyMessageAlignment(inserted);
+            }
             
             // Remove loading indicator if it exists
             const loadingIndicator = container.querySelector('.loading-indicator');
@@ -255,16 +331,7 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
             
             if (scrollToIndex !== null && scrollToIndex !== undefined) {
                 setTimeout(() => {
-                    const el = document.getElementById('msg-' + scrollToIndex);
-                    if (el) {
-                        try {
-                            el.scrollIntoView({behavior: 'smooth', block: 'center'});
-                        } catch (e) {
-                            el.scrollIntoView();
-                        }
-                        el.classList.add('flash');
-                        setTimeout(() => el.classList.remove('flash'), 1800);
-                    }
+                    flashMessage(document.getElementById('msg-' + scrollToIndex));
                 }, 60);
             }
         })
@@ -281,6 +348,17 @@ function loadPage(page, query = '', scrollToIndex = null, mode = 'replace') {
         });
 }
 
+function flashMessage(el) {
+    if (!el) return;
+    try {
+        el.scrollIntoView({behavior: 'smooth', block: 'center'});
+    } catch (e) {
+        el.scrollIntoView();
+    }
+    el.classList.add('flash');
+    setTimeout(() => el.classList.remove('flash'), 1800);
+}
+
 function renderPagination(page, totalMatches) {
     const totalPages = Math.ceil(totalMatches / window.config.batchSize);
     let html = '';
@@ -289,9 +367,17 @@ function renderPagination(page, totalMatches) {
         html += `<button onclick="loadPage(${page - 1}, document.getElementById('search-box').value)">← Prev</button>`;
     }
     
-    html += `Page ${page + 1} of ${totalPages || 1} (${totalMatches} matches)`;
+    if (window.searchPartial) {
+        // Regex and fuzzy searches stop early, so only a lower bound is known
+        html += `Page ${page + 1} (${totalMatches}+ matches)`;
+    } else {
+        html += `Page ${page + 1} of ${totalPages || 1} (${totalMatches} matches)`;
+    }
+    if (window.ingesting) {
+        html += ` — parsing in progress, ${totalMatches} so far`;
+    }
     
-    if (page < totalPages - 1) {
+    if (page < totalPages - 1 || window.searchPartial) {
         html += `<button onclick="loadPage(${page + 1}, document.getElementById('search-box').value)">Next →</button>`;
     }
     
@@ -299,6 +385,16 @@ function renderPagination(page, totalMatches) {
 }
 
 function populateSenderDropdown(senders) {
+    const filterSelect = document.getElementById('filter-sender');
+    if (filterSelect && filterSelect.options.length <= 1) {
+        senders.forEach(name => {
+            const opt = document.createElement('option');
+            opt.value = name;
+            opt.textContent = name;
+            filterSelect.appendChild(opt);
+        });
+    }
+
     const select = document.getElementById('my-name');
     if (select.options.length <= 1) {
         senders.forEach(name => {
@@ -313,11 +409,13 @@ function populateSenderDropdown(senders) {
     }
 }
 
-function applyMessageAlignment() {
+function applyMessageAlignment(root) {
+    // Align the messages under root (a freshly inserted page), or every rendered message
+    const scope = root instanceof Element ? root : document;
     window.myName = document.getElementById('my-name').value;
     try { localStorage.setItem('whatsapp_my_name_' + window.config.encodedFile, window.myName); } catch (e) {}
 
-    document.querySelectorAll('.message').forEach(msgDiv => {
+    scope.querySelectorAll('.message').forEach(msgDiv => {
         const senderElem = msgDiv.querySelector('.sender');
         const senderName = senderElem ? senderElem.textContent : null;
         msgDiv.classList.remove('sent', 'received');
@@ -341,9 +439,17 @@ function handleJump() {
         return;
     }
 
+    // A date (YYYY-MM-DD or YYYY-MM) jumps to the first message on or after it
+    if (/^\d{4}-\d{1,2}(-\d{1,2})?$/.test(val)) {
+        jumpToDate(val);
+        return;
+    }
+
     // Otherwise try to find first message matching the text
     const q = val;
-    fetch(`/api/find?file=${window.config.encodedFile}&q=${encodeURIComponent(q)}`)
+    const searchMode = document.getElementById('search-mode');
+    const modeParam = searchMode && searchMode.value ? `&mode=${searchMode.value}` : '';
+    fetch(`/api/find?file=${window.config.encodedFile}&q=${encodeURIComponent(q)}${modeParam}`)
         .then(r => r.json())
         .then(data => {
             if (data && typeof data.index === 'number' && data.index >= 0) {
@@ -355,9 +461,35 @@ function handleJump() {
         .catch(() => alert('Failed to search'));
 }
 
+function jumpToDate(val) {
+    fetch(`/api/jump?file=${window.config.encodedFile}&date=${encodeURIComponent(val)}&batch_size=${window.config.batchSize}`)
+        .then(r => r.json())
+        .then(data => {
+            if (data && typeof data.index === 'number' && data.index >= 0) {
+                goToMessage(data.index);
+            } else if (data && data.error) {
+                alert(data.error);
+            } else if (data && data.ingesting) {
+                // The chat isn't parsed up to that date yet: ask again rather than report no messages
+                setTimeout(() => jumpToDate(val), window.ingestPollMs);
+            } else {
+                alert('No messages on or after ' + val);
+            }
+        })
+        .catch(() => alert('Failed to jump to date'));
+}
+
 function goToMessage(globalIndex) {
     if (typeof globalIndex === 'undefined' || globalIndex === null) return;
     const pageToLoad = Math.floor(globalIndex / window.config.batchSize);
     const queryVal = document.getElementById('search-box').value || '';
+    const rendered = document.getElementById('msg-' + globalIndex);
+    if (rendered) {
+        flashMessage(rendered);
+        return;
+    }
+    // Its page may only be a recycled spacer: start a fresh window around it
+    window.loadedPages = new Set();
+    window.hasMoreMessages = true;
     loadPage(pageToLoad, queryVal, globalIndex);
 }
\ No newline at end of file
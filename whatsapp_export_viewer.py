@@ -1,16 +1,45 @@
+import argparse
+import bisect
+import contextlib
+import cProfile
+import email.utils
+import functools
 import hashlib
 import html
+import io
+import itertools
 import json
+import mmap
+import multiprocessing
 import os
+import pstats
+import random
 import re
 import shutil
+import signal
+import struct
+import sys
+import threading
+import time
 import urllib.parse
+import weakref
 import webbrowser
 import zipfile
-from datetime import datetime
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import date, datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qs
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 # ----------------------------
 # Configuration
 # ----------------------------
@@ -22,6 +51,202 @@ os.makedirs(CACHE_DIR, exist_ok=True)
 
 BATCH_SIZE = 50
 
+# Parsed chats kept in memory between requests (least recently used are evicted first)
+CHAT_STORE_MAX_CHATS = 4
+CHAT_STORE_MAX_MESSAGES = 5000000
+
+# How media is read: 'zip' parses the chat and serves media straight from the ZIP,
+# 'lazy' does the same but extracts each media file to .cache/ the first time it is
+# requested, and 'full' extracts the whole archive before parsing (the old behaviour)
+EXTRACT_MODE = 'zip'
+
+# First-time parses run in the background; readers see new messages in batches of this size
+INGEST_PUBLISH_EVERY = 500
+# How long a request waits for the messages it asks for before answering with what is available
+INGEST_PAGE_WAIT_SECONDS = 2.0
+# Chat texts of at least PARALLEL_PARSE_MIN_BYTES are parsed on PARSE_WORKERS processes, in
+# line-aligned chunks of about PARSE_CHUNK_BYTES (set PARSE_WORKERS to 1 to always parse serially)
+PARSE_WORKERS = os.cpu_count() or 1
+PARSE_CHUNK_BYTES = 16 * 1024 * 1024
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 * 1024
+
+# On-disk format of parsed chats: 'binary' (random access, see MessageFile) or 'json'
+CACHE_FORMAT = 'binary'
+
+# A new export whose chat text starts with the whole text of an already parsed export only has
+# its new lines parsed (see ChatFingerprint); the fingerprint hashes the first
+# FINGERPRINT_HEAD_LINES lines to find such exports and checkpoints every FINGERPRINT_CHECKPOINT_LINES
+INCREMENTAL_IMPORT = True
+FINGERPRINT_HEAD_LINES = 64
+FINGERPRINT_CHECKPOINT_LINES = 100000
+
+# Recent search results remembered per chat, so paging through a query doesn't search again
+SEARCH_RESULTS_PER_CHAT = 16
+
+# Regex and fuzzy searches scan the chat in chunks of this many messages on a pool of
+# worker processes (set SEARCH_WORKERS to 1 to scan on the request thread instead)
+SEARCH_WORKERS = os.cpu_count() or 1
+SEARCH_CHUNK_SIZE = 20000
+# A regex chunk still scanning after this many seconds (e.g. a catastrophically backtracking
+# pattern) is abandoned and the search fails; regexes always run on the pool so their scan can be
+# interrupted. Fuzzy scans are slow but always finish, so they have no limit
+SEARCH_CHUNK_TIMEOUT_SECONDS = 10.0
+# Most typos (edits) a fuzzy search tolerates; by default one per four characters of the query
+FUZZY_MAX_DISTANCE = 3
+
+# /api/search_all: exports searched at once, seconds one export may take (to parse and search)
+# before it is reported as timed out, and default caps on matches per export and in total
+SEARCH_ALL_CONCURRENCY = 4
+SEARCH_ALL_TIMEOUT_SECONDS = 30.0
+SEARCH_ALL_PER_FILE = 20
+SEARCH_ALL_LIMIT = 1000
+
+# Memory allowed for rendered /api/messages pages kept for scrolling back and other viewers
+FRAGMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Text responses at least this large are compressed when the client accepts it
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+# Bytes .cache/ may use for parsed chats, their indexes and extracted media before the least
+# recently used exports are evicted, and how often the background janitor checks
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+CACHE_JANITOR_INTERVAL_SECONDS = 300
+# An export's access time is written to its cached messages' mtime at most this often between
+# sweeps, so the janitor of another --workers process sees that it is in use
+CACHE_TOUCH_WRITE_INTERVAL_SECONDS = 60
+
+# A --workers process that dies within this many seconds of starting is replaced only after this delay
+WORKER_RESTART_DELAY_SECONDS = 1.0
+
+# Fraction of requests run under cProfile, with the profile saved to PROFILE_DIR
+# (any single request can also be profiled on demand with ?profile=1, see Handler.do_GET)
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+
+
+# ----------------------------
+# Metrics
+# ----------------------------
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = 'whatsapp_viewer_'
+
+METRIC_DESCRIPTIONS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint and status code'),
+    'http_request_duration_seconds': ('histogram', 'Time to answer an HTTP request, by endpoint'),
+    'stage_duration_seconds': ('histogram', 'Time spent in each loading, search and rendering stage'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss)'),
+    'cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits since startup'),
+    'cache_evictions_total': ('counter', 'Exports whose cached files were evicted to stay under CACHE_MAX_BYTES'),
+    'cache_evicted_bytes_total': ('counter', 'Bytes freed by cache evictions'),
+}
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms, exported in Prometheus text format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0, 0.0]
+            hist[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist[-1] += seconds
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage):
+        """Time a block as one processing stage"""
+        return self.time('stage_duration_seconds', stage=stage)
+
+    def cache_lookup(self, cache, hit):
+        self.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+
+        lookups = {}
+        for (name, labels), value in counters.items():
+            if name == 'cache_requests_total':
+                label_map = dict(labels)
+                totals = lookups.setdefault(label_map['cache'], [0, 0])
+                totals[0 if label_map['result'] == 'hit' else 1] += value
+        gauges = {('cache_hit_ratio', (('cache', cache),)): hits / (hits + misses)
+                  for cache, (hits, misses) in lookups.items() if hits + misses}
+
+        samples = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            samples.setdefault(name, []).append(f'{METRIC_PREFIX}{name}{_format_labels(labels)} {value}')
+        for (name, labels), hist in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets, hist):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            cumulative += hist[len(self.buckets)]
+            lines.append(f'{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {hist[-1]}')
+            lines.append(f'{METRIC_PREFIX}{name}_count{_format_labels(labels)} {cumulative}')
+
+        out = []
+        for name in sorted(samples):
+            kind, help_text = METRIC_DESCRIPTIONS.get(name, ('untyped', name))
+            out.append(f'# HELP {METRIC_PREFIX}{name} {help_text}')
+            out.append(f'# TYPE {METRIC_PREFIX}{name} {kind}')
+            out.extend(sorted(samples[name]) if kind != 'histogram' else samples[name])
+        return '\n'.join(out) + '\n'
+
+
+METRICS = Metrics()
+
+
+def timed_stage(stage):
+    """Decorator recording every call of a function as a processing stage"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with METRICS.stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
 
 # ----------------------------
 # Utilities
@@ -31,14 +256,96 @@ def get_zip_files():
     return sorted([f for f in os.listdir(EXPORTS_DIR) if f.lower().endswith('.zip')])
 
 
+def is_chat_file_name(f):
+    return f.endswith('.txt') and ('chat' in f.lower() or 'whatsapp' in f.lower())
+
+
 def find_chat_file_in_dir(root_dir):
     for dirpath, _, filenames in os.walk(root_dir):
         for f in filenames:
-            if f.endswith('.txt') and ('chat' in f.lower() or 'whatsapp' in f.lower()):
+            if is_chat_file_name(f):
                 return os.path.join(dirpath, f)
     raise FileNotFoundError('No chat .txt found in extracted ZIP')
 
 
+class _KeyedLock:
+    """A threading.Lock that can be weakly referenced"""
+
+    __slots__ = ('_lock', '__weakref__')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+# Entries disappear once no caller holds or waits on their lock, so one-off keys don't pile up
+_key_locks = weakref.WeakValueDictionary()
+_key_locks_guard = threading.Lock()
+
+
+def keyed_lock(key):
+    """Return the lock shared by every caller using the same key (e.g. one per ZIP hash)"""
+    with _key_locks_guard:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = _KeyedLock()
+        return lock
+
+
+def lock_export_file(zip_hash, kind, shared=False, blocking=True):
+    """flock .cache/<hash>.<kind>.lock, which other server processes see too; close the returned file to unlock
+
+    Returns None when blocking is False and another holder's lock conflicts.
+    Without fcntl (Windows, where --workers is not available) nothing is locked.
+    """
+    path = os.path.join(CACHE_DIR, f'{zip_hash}.{kind}.lock')
+    while True:
+        f = open(path, 'ab')
+        if fcntl is None:
+            return f
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            f.close()
+            return None
+        # Eviction deletes lock files while holding them; if this one went meanwhile, lock the new one
+        with contextlib.suppress(FileNotFoundError):
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        f.close()
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', **kwargs):
+    """Write to a temporary sibling and rename it over path, so readers never see a partial file"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+@timed_stage('compute_file_hash')
 def compute_file_hash(filepath):
     hash_md5 = hashlib.md5()
     with open(filepath, 'rb') as f:
@@ -47,208 +354,2115 @@ def compute_file_hash(filepath):
     return hash_md5.hexdigest()
 
 
-def parse_chat_streaming(chat_path, chat_dir):
+MEDIA_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.3gp', '.mov', '.mp3', '.opus', '.aac', '.wav')
+
+
+class MediaIndex:
+    """Filenames under a chat directory, walked once and looked up by basename or suffix"""
+
+    def __init__(self, paths):
+        # Relative '/'-separated paths in os.walk order; lookups return the earliest match
+        self.paths = paths
+        self._reversed_names = sorted((os.path.basename(p).lower()[::-1], i) for i, p in enumerate(paths))
+        self.first_media = next((p for p in paths if os.path.splitext(p)[1].lower() in MEDIA_EXTENSIONS), None)
+
+    @classmethod
+    def build(cls, chat_dir):
+        paths = []
+        for root, _, files in os.walk(chat_dir):
+            for f in files:
+                paths.append(os.path.relpath(os.path.join(root, f), chat_dir).replace(os.sep, '/'))
+        return cls(paths)
+
+    def find(self, fname):
+        """Return the first path whose basename equals or ends with basename(fname)"""
+        key = os.path.basename(fname).lower()[::-1]
+        lo = bisect.bisect_left(self._reversed_names, (key,))
+        best = None
+        for name, i in itertools.islice(self._reversed_names, lo, None):
+            if not name.startswith(key):
+                break
+            if best is None or i < best:
+                best = i
+        return self.paths[best] if best is not None else None
+
+    def save(self, index_file):
+        with atomic_write(index_file, 'w', encoding='utf-8') as f:
+            json.dump({'paths': self.paths}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_file):
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return cls(json.load(f)['paths'])
+        except (ValueError, KeyError):
+            return None
+
+
+class ZipMembers:
+    """Central-directory index of an export ZIP: where the chat is and which media it holds"""
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.infos = {info.filename: info for info in zf.infolist() if not info.is_dir()}
+        self.chat_member = next((n for n in self.infos if is_chat_file_name(n.rsplit('/', 1)[-1])), None)
+        if self.chat_member is None:
+            raise FileNotFoundError('No chat .txt found in ZIP')
+        # Media paths in messages are relative to the directory holding the chat .txt
+        self.chat_dir = self.chat_member[:self.chat_member.rfind('/') + 1]
+        self._data_offsets = {}
+
+    def media_index(self):
+        return MediaIndex([n[len(self.chat_dir):] for n in self.infos if n.startswith(self.chat_dir)])
+
+    def get(self, rel_path):
+        return self.infos.get(self.chat_dir + rel_path)
+
+    def data_offset(self, info):
+        """Byte offset of a member's data inside the ZIP (read from its local header once)"""
+        offset = self._data_offsets.get(info.filename)
+        if offset is None:
+            with open(self.zip_path, 'rb') as f:
+                f.seek(info.header_offset)
+                header = f.read(30)
+            if header[:4] != b'PK\x03\x04':
+                raise zipfile.BadZipFile('Bad local file header')
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            offset = self._data_offsets[info.filename] = info.header_offset + 30 + name_len + extra_len
+        return offset
+
+
+_zip_members = OrderedDict()
+_zip_members_lock = threading.Lock()
+
+
+def get_zip_members(zip_path):
+    """ZipMembers for a ZIP, re-read only when the file's fingerprint changes"""
+    fingerprint = file_fingerprint(zip_path)
+    with _zip_members_lock:
+        members = _zip_members.get(fingerprint)
+        if members is not None:
+            _zip_members.move_to_end(fingerprint)
+            return members
+    members = ZipMembers(zip_path)
+    with _zip_members_lock:
+        _zip_members[fingerprint] = members
+        while len(_zip_members) > 32:
+            _zip_members.popitem(last=False)
+    return members
+
+
+# ----------------------------
+# Timestamps
+# ----------------------------
+
+# How many message headers parse_chat_lines() looks at before settling on a timestamp dialect
+DIALECT_SAMPLE_HEADERS = 1000
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Any WhatsApp timestamp: a date in some field order, a time with optional seconds and AM/PM
+_GENERIC_TIMESTAMP_RE = re.compile(
+    r'^(\d{1,4})[./-](\d{1,2})[./-](\d{1,4}),?\s+(\d{1,2})[:.](\d{2})(?:[:.](\d{2}))?'
+    r'\s*(?:([AaPp])\.?\s?[Mm]\.?)?$')
+
+
+class TimestampDialect:
+    """The date/time layout of one export, detected once and compiled into a single regex
+
+    ``order`` is 'mdy' (US), 'dmy' (most other locales) or 'ymd'. parse()
+    returns the wall-clock time as seconds since 1970-01-01, read as if it
+    were UTC (exports carry no timezone), or None for strings it can't read.
+    """
+
+    def __init__(self, order, separator='/', has_seconds=False, twelve_hour=False):
+        self.order = order
+        self.separator = separator
+        self.has_seconds = has_seconds
+        self.twelve_hour = twelve_hour
+        sep = re.escape(separator)
+        self._regex = re.compile(
+            rf'^(\d{{1,4}}){sep}(\d{{1,2}}){sep}(\d{{1,4}}),?\s+(\d{{1,2}})[:.](\d{{2}})'
+            + (r'[:.](\d{2})' if has_seconds else r'()')
+            + (r'\s*([AaPp])\.?\s?[Mm]\.?$' if twelve_hour else r'()$'))
+        self._fields = (order.index('d'), order.index('m'), order.index('y'))
+
+    def __repr__(self):
+        return (f'TimestampDialect({self.order!r}, {self.separator!r}, '
+                f'has_seconds={self.has_seconds}, twelve_hour={self.twelve_hour})')
+
+    @classmethod
+    def detect(cls, raw_timestamps):
+        """Pick the dialect that fits a sample of raw timestamp strings"""
+        matches = [m for m in map(_GENERIC_TIMESTAMP_RE.match, raw_timestamps) if m]
+        if not matches:
+            return cls('dmy')
+        first = [int(m.group(1)) for m in matches]
+        second = [int(m.group(2)) for m in matches]
+        if any(len(m.group(1)) == 4 for m in matches):
+            order = 'ymd'
+        elif any(v > 12 for v in first):
+            order = 'dmy'
+        elif any(v > 12 for v in second):
+            order = 'mdy'
+        else:
+            # Ambiguous sample: US iOS exports use 12-hour clocks with seconds and two-digit years
+            us_style = all(m.group(6) and m.group(7) and len(m.group(3)) == 2 for m in matches)
+            order = 'mdy' if us_style else 'dmy'
+        separator = re.match(r'^\d+(\D)', matches[0].group(0)).group(1)
+        return cls(order,
+                   separator=separator,
+                   has_seconds=sum(1 for m in matches if m.group(6)) * 2 > len(matches),
+                   twelve_hour=sum(1 for m in matches if m.group(7)) * 2 > len(matches))
+
+    def parse(self, raw):
+        m = self._regex.match(raw) or _GENERIC_TIMESTAMP_RE.match(raw)
+        if m is None:
+            return None
+        groups = m.groups()
+        d_i, m_i, y_i = self._fields
+        day, month, year = int(groups[d_i]), int(groups[m_i]), int(groups[y_i])
+        hour, minute = int(groups[3]), int(groups[4])
+        second = int(groups[5]) if groups[5] else 0
+        meridiem = groups[6]
+        if year < 100:
+            year += 2000
+        if meridiem:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem in 'Pp' else 0)
+        if hour > 23 or minute > 59 or second > 59:
+            return None
+        try:
+            days = date(year, month, day).toordinal() - _EPOCH_ORDINAL
+        except ValueError:
+            return None
+        return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+def format_clock(epoch):
+    """'03:07 PM' for a parsed timestamp, like strftime('%I:%M %p')"""
+    minutes = (epoch // 60) % 1440
+    hour, minute = divmod(minutes, 60)
+    return '%02d:%02d %s' % (hour % 12 or 12, minute, 'PM' if hour >= 12 else 'AM')
+
+
+def _clean_line(line):
+    line = line.rstrip('\n\r')
+    line = line.lstrip('\ufeff\u200e\u200f')
+    return line.replace('\u202f', ' ').replace('\xa0', ' ')
+
+
+_BRACKET_HEADER_RE = re.compile(r'^\[(?P<ts>[^\]]+)\]\s*(?P<content>.*)')
+_DASH_HEADER_RE = re.compile(r'^(?P<ts>[^-]+)\s*-\s*(?P<content>.*)')
+
+
+def _match_header(line):
+    return _BRACKET_HEADER_RE.match(line) or _DASH_HEADER_RE.match(line)
+
+
+_SENDER_RE = re.compile(r'^(.*?):\s*(.*)')
+_ATTACHED_TAG_RE = re.compile(r'<attached:\s*([^>]+)>', re.I)
+_ATTACHED_RE = re.compile(r'attached:\s*([^\n\r]+)', re.I)
+_MEDIA_FILE_RE = re.compile(r'([^\s"\'=<>]+?\.(?:jpg|jpeg|png|gif|webp|mp4|mov|3gp|mp3|opus|aac|wav))', re.I)
+_ATTACHED_TAG_STRIP_RE = re.compile(r'<attached:[^>]+>', re.I)
+_ATTACHED_STRIP_RE = re.compile(r'attached:\s*[^\n\r]+', re.I)
+_MEDIA_OMITTED_RE = re.compile(r'<media omitted>|<Media omitted>|<attached media omitted>', re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def parse_chat_streaming(chat_path, chat_dir, media_index=None, workers=1):
+    if media_index is None:
+        media_index = MediaIndex.build(chat_dir)
+    if workers > 1:
+        yield from parse_chat_parallel(chat_path, media_index, workers=workers)
+        return
     with open(chat_path, 'r', encoding='utf-8', errors='replace') as f:
-        current_msg = None
-        for line in f:
-            line = line.rstrip('\n\r')
-            line = line.lstrip('\ufeff\u200e\u200f')
-            line = line.replace('\u202f', ' ').replace('\xa0', ' ')
-            if not line.strip():
-                continue
+        yield from parse_chat_lines(f, media_index)
 
-            match = re.match(r'^\[(?P<ts>[^\]]+)\]\s*(?P<content>.*)', line)
-            if not match:
-                match = re.match(r'^(?P<ts>[^-]+)\s*-\s*(?P<content>.*)', line)
 
-            if match:
-                if current_msg:
-                    yield current_msg
+def _sample_timestamps(lines):
+    """Read lines until enough message headers are seen; return (lines read, their timestamps)"""
+    head, samples = [], []
+    for line in lines:
+        head.append(line)
+        match = _match_header(_clean_line(line))
+        if match:
+            samples.append(match.group('ts').strip())
+            if len(samples) >= DIALECT_SAMPLE_HEADERS:
+                break
+    return head, samples
+
+
+def parse_chat_lines(lines, media_index, dialect=None):
+    """Turn the lines of an exported chat into message dicts, resolving media through media_index
+
+    The timestamp dialect is detected from the first message headers unless given.
+    """
+    lines = iter(lines)
+    if dialect is None:
+        head, samples = _sample_timestamps(lines)
+        dialect = TimestampDialect.detect(samples)
+        lines = itertools.chain(head, lines)
+    parse_timestamp = dialect.parse
+
+    current_msg = None
+    for line in lines:
+        line = _clean_line(line)
+        if not line.strip():
+            continue
 
-                raw_ts = match.group('ts').strip()
-                content = match.group('content')
+        match = _match_header(line)
 
-                sender_match = re.match(r'^(.*?):\s*(.*)', content)
-                if sender_match:
-                    sender, text = sender_match.groups()
-                    is_system = False
+        if match:
+            if current_msg:
+                yield current_msg
+
+            raw_ts = match.group('ts').strip()
+            content = match.group('content')
+
+            sender_match = _SENDER_RE.match(content)
+            if sender_match:
+                sender, text = sender_match.groups()
+                is_system = False
+            else:
+                sender = 'System'
+                text = content
+                is_system = True
+
+            is_media = False
+            media_rel_path = None
+
+            attached_match = _ATTACHED_TAG_RE.search(text)
+            if not attached_match:
+                attached_match = _ATTACHED_RE.search(text)
+
+            if attached_match:
+                raw_group = attached_match.group(1)
+                fn_search = _MEDIA_FILE_RE.search(raw_group)
+                if fn_search:
+                    fname = fn_search.group(1).strip().strip('"').strip("'")
                 else:
-                    sender = 'System'
-                    text = content
-                    is_system = True
-
-                is_media = False
-                media_rel_path = None
-
-                attached_match = re.search(r'<attached:\s*([^>]+)>', text, flags=re.I)
-                if not attached_match:
-                    attached_match = re.search(r'attached:\s*([^\n\r]+)', text, flags=re.I)
-
-                if attached_match:
-                    raw_group = attached_match.group(1)
-                    fn_search = re.search(r'([^\s"\'=<>]+?\.(?:jpg|jpeg|png|gif|webp|mp4|mov|3gp|mp3|opus|aac|wav))',
-                                          raw_group, flags=re.I)
-                    if fn_search:
-                        fname = fn_search.group(1).strip().strip('"').strip("'")
-                    else:
-                        fname = raw_group.strip().strip('"').strip("'")
-                    fname = fname.replace('\ufeff', '').replace('\u200e', '').replace('\u200f', '')
-
-                    for root, _, files in os.walk(chat_dir):
-                        for f in files:
-                            if f.lower() == os.path.basename(fname).lower() or f.lower().endswith(
-                                    os.path.basename(fname).lower()):
-                                media_candidate = os.path.relpath(os.path.join(root, f), chat_dir)
-                                media_rel_path = urllib.parse.quote(media_candidate.replace(os.sep, '/'))
-                                is_media = True
-                                break
-                        if is_media:
-                            break
+                    fname = raw_group.strip().strip('"').strip("'")
+                fname = fname.replace('\ufeff', '').replace('\u200e', '').replace('\u200f', '')
+
+                media_candidate = media_index.find(fname)
+                if media_candidate is not None:
+                    media_rel_path = urllib.parse.quote(media_candidate)
+                    is_media = True
+
+                text = _ATTACHED_TAG_STRIP_RE.sub('', text)
+                text = _ATTACHED_STRIP_RE.sub('', text)
+
+            if not is_media:
+                if _MEDIA_OMITTED_RE.search(text) or '<Media omitted>' in text:
+                    is_media = True
+                    if media_index.first_media is not None:
+                        media_rel_path = urllib.parse.quote(media_index.first_media)
+                    text = _TAG_RE.sub('', text)
+
+            if is_media:
+                text = ''
+
+            current_msg = {
+                'timestamp': raw_ts,
+                'epoch': parse_timestamp(raw_ts),
+                'sender': sender,
+                'text': text,
+                'is_media': is_media,
+                'media_path': media_rel_path,
+                'is_system': is_system
+            }
+        else:
+            if current_msg:
+                current_msg['text'] += '\n' + line
 
-                    text = re.sub(r'<attached:[^>]+>', '', text, flags=re.I)
-                    text = re.sub(r'attached:\s*[^\n\r]+', '', text, flags=re.I)
-
-                if not is_media:
-                    if re.search(r'<media omitted>|<Media omitted>|<attached media omitted>', text, flags=re.I) or (
-                            '<Media omitted>' in text):
-                        is_media = True
-                        for root, _, files in os.walk(chat_dir):
-                            for f in files:
-                                ext = os.path.splitext(f)[1].lower()
-                                if ext in ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.3gp', '.mov', '.mp3', '.opus',
-                                           '.aac', '.wav'):
-                                    media_candidate = os.path.relpath(os.path.join(root, f), chat_dir)
-                                    media_rel_path = urllib.parse.quote(media_candidate.replace(os.sep, '/'))
-                                    break
-                            if media_rel_path:
-                                break
-                        text = re.sub(r'<[^>]+>', '', text)
-
-                if is_media:
-                    text = ''
-
-                current_msg = {
-                    'timestamp': raw_ts,
-                    'sender': sender,
-                    'text': text,
-                    'is_media': is_media,
-                    'media_path': media_rel_path,
-                    'is_system': is_system
-                }
+    if current_msg:
+        yield current_msg
+
+
+def file_fingerprint(filepath):
+    """Cheap identity of a file: absolute path, size and modification time"""
+    st = os.stat(filepath)
+    return (os.path.abspath(filepath), st.st_size, st.st_mtime_ns)
+
+
+_zip_hashes = {}
+_zip_hashes_lock = threading.Lock()
+
+
+def get_zip_hash(zip_path):
+    """Return the MD5 of a ZIP, only re-hashing when its fingerprint changes"""
+    fingerprint = file_fingerprint(zip_path)
+    zip_hash = _zip_hashes.get(fingerprint)
+    METRICS.cache_lookup('zip_hash', zip_hash is not None)
+    if zip_hash is None:
+        # Requests arriving together for a new or changed ZIP share a single MD5 pass
+        with keyed_lock(('hash', fingerprint[0])):
+            zip_hash = _zip_hashes.get(fingerprint)
+            if zip_hash is None:
+                zip_hash = compute_file_hash(zip_path)
+                with _zip_hashes_lock:
+                    for stale in [k for k in _zip_hashes if k[0] == fingerprint[0]]:
+                        del _zip_hashes[stale]
+                    _zip_hashes[fingerprint] = zip_hash
+    return zip_hash
+
+
+# ----------------------------
+# Parallel parsing
+# ----------------------------
+
+def line_aligned_ranges(chat_path, chunk_bytes):
+    """Cut a file into (start, stop) byte ranges of about chunk_bytes, each ending just after a newline"""
+    size = os.path.getsize(chat_path)
+    ranges = []
+    start = 0
+    with open(chat_path, 'rb') as f:
+        while start < size:
+            f.seek(min(size, start + chunk_bytes))
+            f.readline()
+            stop = min(size, f.tell())
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def _chunk_lines(f, start, stop):
+    """The text lines of bytes [start, stop) of a chat file, decoded like a whole-file read"""
+    f.seek(start)
+    return io.TextIOWrapper(io.BytesIO(f.read(stop - start)), encoding='utf-8', errors='replace')
+
+
+_parse_worker = {}
+
+
+def _init_parse_worker(chat_path, media_index, dialect):
+    _parse_worker.update(chat_path=chat_path, media_index=media_index, dialect=dialect)
+
+
+def _parse_chunk(start, stop):
+    """Parse one chunk in a worker: (lines before its first header, its messages, media lookups, first_media_used)
+
+    The leading lines continue the last message of the chunks before; the
+    parent appends them, so messages crossing a boundary come out whole.
+    """
+    with open(_parse_worker['chat_path'], 'rb') as f:
+        lines = _chunk_lines(f, start, stop)
+    leading = []
+    first = None
+    for line in lines:
+        cleaned = _clean_line(line)
+        if not cleaned.strip():
+            continue
+        if _match_header(cleaned):
+            first = line
+            break
+        leading.append(cleaned)
+    fingerprint = ChatFingerprint()
+    messages = []
+    if first is not None:
+        recorder = RecordingMediaIndex(_parse_worker['media_index'], fingerprint)
+        messages = list(parse_chat_lines(itertools.chain([first], lines), recorder, _parse_worker['dialect']))
+    return leading, messages, fingerprint.lookups, fingerprint.first_media_used
+
+
+def parse_chat_parallel(chat_path, media_index, fingerprint=None, workers=None, chunk_bytes=None):
+    """Parse a chat file on a process pool; yields exactly what parse_chat_lines() would
+
+    The timestamp dialect is detected here from the first headers and the file
+    is cut into line-aligned chunks parsed by the workers, a few per worker in
+    flight and merged in order. If a fingerprint is given it hashes every line
+    (in this process, while the workers parse) and records the workers' media lookups.
+    """
+    workers = workers or PARSE_WORKERS
+    with open(chat_path, 'r', encoding='utf-8', errors='replace') as f:
+        dialect = TimestampDialect.detect(_sample_timestamps(f)[1])
+    ranges = iter(line_aligned_ranges(chat_path, chunk_bytes or PARSE_CHUNK_BYTES))
+    if fingerprint is not None:
+        fingerprint.first_media = media_index.first_media
+
+    # Spawned for the same reason as the search pool, and only for the length of one parse
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_parse_worker, initargs=(chat_path, media_index, dialect)) as pool, \
+            open(chat_path, 'rb') as raw:
+        pending = deque()
+        for start, stop in itertools.islice(ranges, 2 * workers):
+            pending.append((start, stop, pool.submit(_parse_chunk, start, stop)))
+        last = None
+        try:
+            while pending:
+                start, stop, future = pending.popleft()
+                if fingerprint is not None:
+                    fingerprint.update_text(_chunk_lines(raw, start, stop).read())
+                leading, messages, lookups, first_media_used = future.result()
+                for start, stop in itertools.islice(ranges, 1):
+                    pending.append((start, stop, pool.submit(_parse_chunk, start, stop)))
+                if fingerprint is not None:
+                    fingerprint.lookups.update(lookups)
+                    fingerprint.first_media_used = fingerprint.first_media_used or first_media_used
+                if last is not None:
+                    for line in leading:
+                        last['text'] += '\n' + line
+                if messages:
+                    if last is not None:
+                        yield last
+                    yield from itertools.islice(messages, len(messages) - 1)
+                    last = messages[-1]
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+    if last is not None:
+        yield last
+
+
+def parallel_parse_file(zip_path, zip_hash):
+    """Path on disk of a chat .txt big enough to parse in parallel (extracting it if needed), else None"""
+    if PARSE_WORKERS <= 1:
+        return None
+    if EXTRACT_MODE == 'full':
+        chat_file = find_chat_file_in_dir(extract_zip(zip_path, zip_hash))
+        return chat_file if os.path.getsize(chat_file) >= PARALLEL_PARSE_MIN_BYTES else None
+    members = get_zip_members(zip_path)
+    if members.infos[members.chat_member].file_size < PARALLEL_PARSE_MIN_BYTES:
+        return None
+    return extract_member(zip_path, zip_hash, members.chat_member)
+
+
+# ----------------------------
+# Search index
+# ----------------------------
+
+def search_haystack(msg):
+    """The lower-cased text a search query is matched against"""
+    return (msg.get('text', '') + ' ' + msg.get('sender', '')).lower()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PostingIndex:
+    """Sorted lists of message indices under string keys, saved to disk and read back lazily
+
+    On disk: magic, a length-prefixed JSON header mapping each key to the
+    offset and length of its list, then the lists themselves as packed uint32
+    message indices. Loaded indexes read lists from an mmap on first use, so
+    opening a chat only costs the header.
+    """
+
+    MAGIC = None
+    STAGE = None
+
+    def __init__(self, keys, postings=None, buf=None, byteswap=False):
+        self._keys = keys
+        self._postings = postings if postings is not None else {}
+        self._buf = buf
+        self._byteswap = byteswap
+
+    @classmethod
+    def from_lists(cls, postings):
+        return cls(dict.fromkeys(postings), postings)
+
+    def postings(self, key):
+        plist = self._postings.get(key)
+        if plist is None:
+            location = self._keys.get(key)
+            if location is None:
+                return None
+            offset, count = location
+            plist = array('I')
+            plist.frombytes(self._buf[offset:offset + count * plist.itemsize])
+            if self._byteswap:
+                plist.byteswap()
+            self._postings[key] = plist
+        return plist
+
+    def extended(self, tail, offset):
+        """A copy with tail's postings appended, their indices shifted by offset"""
+        postings = {key: array('I', self.postings(key)) for key in self._keys}
+        for key in tail._keys:
+            plist = postings.get(key)
+            if plist is None:
+                plist = postings[key] = array('I')
+            plist.extend(i + offset for i in tail.postings(key))
+        return type(self).from_lists(postings)
+
+    def save(self, index_file):
+        keys = {}
+        offset = 0
+        for key in self._keys:
+            plist = self.postings(key)
+            keys[key] = [offset, len(plist)]
+            offset += len(plist) * plist.itemsize
+        header = json.dumps({'byteorder': sys.byteorder, 'grams': keys}, ensure_ascii=False).encode('utf-8')
+        with atomic_write(index_file) as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for key in keys:
+                self.postings(key).tofile(f)
+
+    @classmethod
+    def load(cls, index_file):
+        if not os.path.exists(index_file):
+            return None
+        with METRICS.stage(f'{cls.STAGE}_load'), open(index_file, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                return None
+            header_len, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            data_start = f.tell()
+            buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[data_start:]
+        return cls({k: tuple(loc) for k, loc in header['grams'].items()}, buf=buf,
+                   byteswap=header['byteorder'] != sys.byteorder)
+
+
+class SearchIndex(PostingIndex):
+    """Trigram posting lists over message text and sender"""
+
+    MAGIC = b'WASEARCH1\n'
+    STAGE = 'search_index'
+
+    @classmethod
+    @timed_stage('search_index_build')
+    def build(cls, messages):
+        postings = {}
+        for i in range(len(messages)):
+            for gram in _trigrams(search_haystack(message_view(messages, i))):
+                plist = postings.get(gram)
+                if plist is None:
+                    plist = postings[gram] = array('I')
+                plist.append(i)
+        return cls.from_lists(postings)
+
+    def candidates(self, query):
+        """Sorted indices that contain every trigram of query, or None if query is too short"""
+        grams = _trigrams(query)
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            plist = self.postings(gram)
+            if plist is None:
+                return []
+            lists.append(plist)
+        return intersect_sorted(lists)
+
+
+MESSAGE_TYPES = ('text', 'media', 'system')
+
+
+def message_type(msg):
+    if msg.get('is_system', False):
+        return 'system'
+    return 'media' if msg.get('is_media', False) else 'text'
+
+
+class FacetIndex(PostingIndex):
+    """Posting lists of the messages of each sender ('sender:<name>') and type ('type:media' etc.)"""
+
+    MAGIC = b'WAFACETS1\n'
+    STAGE = 'facet_index'
+
+    @classmethod
+    @timed_stage('facet_index_build')
+    def build(cls, messages):
+        postings = {}
+        for i in range(len(messages)):
+            msg = message_view(messages, i)
+            for key in ('sender:' + str(msg.get('sender', '')), 'type:' + message_type(msg)):
+                plist = postings.get(key)
+                if plist is None:
+                    plist = postings[key] = array('I')
+                plist.append(i)
+        return cls.from_lists(postings)
+
+    def union(self, field, values):
+        """Sorted indices of the messages whose field is any of values"""
+        lists = [self.postings(f'{field}:{value}') for value in values]
+        lists = [plist for plist in lists if plist]
+        if len(lists) == 1:
+            return list(lists[0])
+        return sorted(set().union(*lists))
+
+
+def intersect_sorted(lists):
+    """Indices present in every one of several sorted index lists"""
+    lists = sorted(lists, key=len)
+    result = list(lists[0])
+    for plist in lists[1:]:
+        # Probe the longer lists by bisection rather than materialising them as sets
+        result = [i for i in result if _contains_sorted(plist, i)]
+        if not result:
+            break
+    return result
+
+
+def _contains_sorted(seq, value):
+    i = bisect.bisect_left(seq, value)
+    return i < len(seq) and seq[i] == value
+
+
+# ----------------------------
+# Regex and fuzzy search
+# ----------------------------
+
+SEARCH_MODES = ('substring', 'regex', 'fuzzy')
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def _raise_search_timeout(signum, frame):
+    raise SearchTimeout()
+
+
+def fuzzy_max_distance(query):
+    """Default number of typos a fuzzy query tolerates: one per four characters"""
+    return min(FUZZY_MAX_DISTANCE, len(query) // 4)
+
+
+def _within_edit_distance(query, text, max_distance):
+    """Whether some substring of text is at most max_distance edits away from query (Sellers' algorithm)"""
+    m = len(query)
+    prev = list(range(m + 1))
+    for ch in text:
+        cur = [0]
+        for j in range(1, m + 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (query[j - 1] != ch)))
+        if cur[m] <= max_distance:
+            return True
+        prev = cur
+    return prev[m] <= max_distance
+
+
+@functools.lru_cache(maxsize=32)
+def pattern_matcher(mode, query, max_distance=0):
+    """A predicate telling whether a search_haystack() matches a regex or fuzzy query
+
+    Raises re.error for an invalid regular expression.
+    """
+    if mode == 'regex':
+        return re.compile(query, re.IGNORECASE).search
+    q = query.lower()
+    if max_distance <= 0:
+        return lambda haystack: q in haystack
+    # Any match within k edits contains one of k + 1 pieces of the query unchanged,
+    # so the edit distance is only computed for haystacks holding one of them
+    step = len(q) // (max_distance + 1)
+    pieces = [q[i * step:(i + 1) * step] for i in range(max_distance)] + [q[max_distance * step:]]
+
+    def match(haystack):
+        return any(p in haystack for p in pieces) and _within_edit_distance(q, haystack, max_distance)
+    return match
+
+
+@functools.lru_cache(maxsize=4)
+def _worker_message_file(cache_file):
+    return MessageFile(cache_file)
+
+
+def _scan_chunk(source, start, stop, mode, query, max_distance, limit, timeout=None):
+    """Indices in [start, stop) matching the query, stopping after limit of them; runs in a search worker
+
+    source is either the path of a binary message cache, which the worker maps
+    itself, or the haystacks of exactly this range. Returns (matches, scanned_up_to),
+    or (None, start) if the scan took longer than timeout seconds. In a worker
+    process a SIGALRM interrupts even a single endless regex match; elsewhere the
+    time is only checked between messages.
+    """
+    match = pattern_matcher(mode, query, max_distance)
+    if isinstance(source, str):
+        messages = _worker_message_file(source)
+        haystacks = (search_haystack(messages[i]) for i in range(start, stop))
+    else:
+        haystacks = iter(source)
+    deadline = time.monotonic() + timeout if timeout else None
+    alarm = bool(timeout) and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    previous = None
+    matches = []
+    try:
+        try:
+            if alarm:
+                previous = signal.signal(signal.SIGALRM, _raise_search_timeout)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            for i, haystack in zip(range(start, stop), haystacks):
+                if match(haystack):
+                    matches.append(i)
+                    if len(matches) >= limit:
+                        return matches, i + 1
+                if deadline is not None and not i & 255 and time.monotonic() > deadline:
+                    raise SearchTimeout()
+        finally:
+            if alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except SearchTimeout:
+        return None, start
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGALRM, previous)
+    return matches, stop
+
+
+def _chunk_source(messages, start, stop):
+    path = getattr(messages, 'path', None)
+    if path is not None:
+        return path
+    return [search_haystack(message_view(messages, i)) for i in range(start, stop)]
+
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+
+def search_pool():
+    """The process pool regex and fuzzy searches run on, started on first use"""
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            # Workers are spawned rather than forked: forking a server with running threads
+            # can leave the children holding locks nobody will release
+            _search_pool = ProcessPoolExecutor(SEARCH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _search_pool
+
+
+def scan_pattern(messages, start, stop, mode, query, max_distance, limit):
+    """The first limit matches of a regex or fuzzy query in messages[start:stop]
+
+    Returns (matches, scanned_up_to). Long ranges are cut into SEARCH_CHUNK_SIZE
+    chunks that the search pool scans in parallel; a few chunks per worker are in
+    flight at a time, in order, and no more are started once the finished ones
+    hold limit matches. Raises SearchTimeout if a regex chunk takes longer than
+    SEARCH_CHUNK_TIMEOUT_SECONDS.
+    """
+    timeout = SEARCH_CHUNK_TIMEOUT_SECONDS if mode == 'regex' else None
+    inline = SEARCH_WORKERS <= 1 or stop - start <= SEARCH_CHUNK_SIZE
+    # Only a worker's scan can be cut short in the middle of a regex match
+    if inline and not (mode == 'regex' and hasattr(signal, 'setitimer')):
+        found, scanned = _scan_chunk(_chunk_source(messages, start, stop), start, stop, mode, query, max_distance,
+                                     limit, timeout)
+        if found is None:
+            raise SearchTimeout(f'Search took longer than {timeout:g} seconds')
+        return found, scanned
+
+    pool = search_pool()
+    bounds = iter(range(start, stop, SEARCH_CHUNK_SIZE))
+    pending = deque()
+
+    def submit(lo):
+        hi = min(stop, lo + SEARCH_CHUNK_SIZE)
+        pending.append(pool.submit(_scan_chunk, _chunk_source(messages, lo, hi), lo, hi,
+                                   mode, query, max_distance, limit, timeout))
+
+    matches = []
+    try:
+        for lo in itertools.islice(bounds, 2 * SEARCH_WORKERS):
+            submit(lo)
+        while pending:
+            found, scanned = pending.popleft().result()
+            if found is None:
+                raise SearchTimeout(f'Search took longer than {timeout:g} seconds')
+            matches.extend(found)
+            if len(matches) >= limit:
+                del matches[limit:]
+                return matches, matches[-1] + 1
+            for lo in itertools.islice(bounds, 1):
+                submit(lo)
+    finally:
+        for future in pending:
+            future.cancel()
+    return matches, stop
+
+
+# ----------------------------
+# Chat statistics
+# ----------------------------
+
+class ChatStats:
+    """Per-chat aggregates, counted once as messages are ingested and saved beside the parsed cache
+
+    Only non-system messages count towards senders. Day, hour and weekday
+    histograms use each message's parsed timestamp; messages whose timestamp
+    didn't parse are counted as undated.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.messages = 0
+        self.media = 0
+        self.system = 0
+        self.undated = 0
+        self.per_sender = {}  # name -> [messages, media]
+        self.per_day = {}  # days since 1970-01-01 -> messages
+        self.per_hour = [0] * 24
+        self.per_weekday = [0] * 7  # Monday first
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def add(self, messages):
+        with self._lock:
+            for msg in messages:
+                self._add(msg)
+
+    def _add(self, msg):
+        self.messages += 1
+        is_media = bool(msg.get('is_media'))
+        self.media += is_media
+        if msg.get('is_system', False):
+            self.system += 1
+        elif 'sender' in msg:
+            counts = self.per_sender.get(msg['sender'])
+            if counts is None:
+                counts = self.per_sender[msg['sender']] = [0, 0]
+            counts[0] += 1
+            counts[1] += is_media
+
+        stamp = {'timestamp': msg.get('timestamp'), 'epoch': msg.get('epoch')}
+        if self.first is None:
+            self.first = stamp
+        self.last = stamp
+        epoch = stamp['epoch']
+        if epoch is None:
+            self.undated += 1
+            return
+        day = epoch // 86400
+        self.per_day[day] = self.per_day.get(day, 0) + 1
+        self.per_hour[epoch % 86400 // 3600] += 1
+        self.per_weekday[(day + 3) % 7] += 1  # 1970-01-01 was a Thursday
+
+    def senders(self):
+        """Sorted names of everyone who sent a non-system message"""
+        with self._lock:
+            return sorted(self.per_sender)
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'messages': self.messages,
+                'media': self.media,
+                'system': self.system,
+                'undated': self.undated,
+                'senders': sorted(self.per_sender),
+                'per_sender': {name: {'messages': c[0], 'media': c[1]} for name, c in sorted(self.per_sender.items())},
+                'per_day': {date.fromordinal(day + _EPOCH_ORDINAL).isoformat(): n
+                            for day, n in sorted(self.per_day.items())},
+                'per_hour': list(self.per_hour),
+                'per_weekday': list(self.per_weekday),
+                'first': self.first,
+                'last': self.last,
+            }
+
+    @classmethod
+    def build(cls, messages):
+        stats = cls()
+        stats.add(message_view(messages, i) for i in range(len(messages)))
+        return stats
+
+    def save(self, stats_file):
+        data = self.to_json()
+        data['version'] = self.VERSION
+        with atomic_write(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, stats_file):
+        if not os.path.exists(stats_file):
+            return None
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION:
+                return None
+            stats = cls()
+            stats.messages = data['messages']
+            stats.media = data['media']
+            stats.system = data['system']
+            stats.undated = data['undated']
+            stats.per_sender = {name: [c['messages'], c['media']] for name, c in data['per_sender'].items()}
+            stats.per_day = {datetime.strptime(day, '%Y-%m-%d').toordinal() - _EPOCH_ORDINAL: n
+                             for day, n in data['per_day'].items()}
+            stats.per_hour = data['per_hour']
+            stats.per_weekday = data['per_weekday']
+            stats.first = data['first']
+            stats.last = data['last']
+            return stats
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+# ----------------------------
+# Date index
+# ----------------------------
+
+class DateIndex:
+    """Messages with a parsed timestamp sorted by (epoch, index), to find a date by bisection
+
+    On disk: magic, a length-prefixed JSON header, then the epochs as packed
+    int64 followed by the matching message indices as packed uint32.
+    """
+
+    MAGIC = b'WADATES1\n'
+
+    def __init__(self, epochs, indices):
+        self.epochs = epochs
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.epochs)
+
+    @classmethod
+    @timed_stage('date_index_build')
+    def build(cls, messages):
+        epochs = array('q')
+        indices = array('I')
+        for i in range(len(messages)):
+            epoch = message_view(messages, i).get('epoch')
+            if epoch is not None:
+                epochs.append(epoch)
+                indices.append(i)
+        return cls._sorted(epochs, indices)
+
+    @classmethod
+    def _sorted(cls, epochs, indices):
+        if any(epochs[i] > epochs[i + 1] for i in range(len(epochs) - 1)):
+            # Exports are nearly always in order already; a stable sort keeps ties in message order
+            order = sorted(range(len(epochs)), key=epochs.__getitem__)
+            epochs = array('q', (epochs[i] for i in order))
+            indices = array('I', (indices[i] for i in order))
+        return cls(epochs, indices)
+
+    def extended(self, tail, offset):
+        """The index of these messages followed by tail's, whose indices are shifted by offset"""
+        return self._sorted(self.epochs + tail.epochs, self.indices + array('I', (i + offset for i in tail.indices)))
+
+    def first_on_or_after(self, epoch):
+        """Index of the earliest message at or after epoch, or None if every message is older"""
+        pos = bisect.bisect_left(self.epochs, epoch)
+        return self.indices[pos] if pos < len(self.indices) else None
+
+    def between(self, start=None, end=None):
+        """Sorted indices of the messages with start <= epoch < end (either bound may be None)"""
+        lo = 0 if start is None else bisect.bisect_left(self.epochs, start)
+        hi = len(self.epochs) if end is None else bisect.bisect_left(self.epochs, end)
+        # Already in order for chronological exports, where sorting is a single linear pass
+        return sorted(self.indices[lo:hi])
+
+    def save(self, index_file):
+        header = json.dumps({'byteorder': sys.byteorder, 'count': len(self.epochs)}).encode('utf-8')
+        with atomic_write(index_file) as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            self.epochs.tofile(f)
+            self.indices.tofile(f)
+
+    @classmethod
+    def load(cls, index_file):
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                return None
+            header_len, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            epochs = array('q')
+            indices = array('I')
+            try:
+                epochs.fromfile(f, header['count'])
+                indices.fromfile(f, header['count'])
+            except EOFError:
+                return None
+        if header['byteorder'] != sys.byteorder:
+            epochs.byteswap()
+            indices.byteswap()
+        return cls(epochs, indices)
+
+
+def parse_jump_date(value, end=False):
+    """Epoch of midnight at the start of 'YYYY-MM-DD', 'YYYY-MM' or 'YYYY', or None if it isn't one
+
+    With end=True, the epoch just after the day, month or year instead, for inclusive ranges.
+    """
+    parts = value.strip().split('-')
+    if not 1 <= len(parts) <= 3 or not all(p.isdigit() for p in parts):
+        return None
+    year, month, day = (list(map(int, parts)) + [1, 1])[:3]
+    try:
+        start = date(year, month, day)
+        if end:
+            if len(parts) == 3:
+                start = date.fromordinal(start.toordinal() + 1)
+            elif len(parts) == 2:
+                start = date(year + month // 12, month % 12 + 1, 1)
+            else:
+                start = date(year + 1, 1, 1)
+    except ValueError:
+        return None
+    return (start.toordinal() - _EPOCH_ORDINAL) * 86400
+
+
+# The indexes saved beside every parsed chat's cache, as (class, file suffix)
+CHAT_INDEXES = ((SearchIndex, 'search.idx'), (FacetIndex, 'facets.idx'), (DateIndex, 'dates.idx'))
+
+
+def chat_index(cls, suffix, zip_hash, messages, rebuild=False):
+    """Load one of a chat's CHAT_INDEXES, building and saving it if missing (always, with rebuild)"""
+    index_file = os.path.join(CACHE_DIR, f'{zip_hash}.{suffix}')
+    index = None if rebuild else cls.load(index_file)
+    if index is None:
+        index = cls.build(messages)
+        index.save(index_file)
+    return index
+
+
+# ----------------------------
+# In-memory chat store
+# ----------------------------
+
+MESSAGE_KEYS = ('timestamp', 'epoch', 'sender', 'text', 'is_media', 'media_path', 'is_system')
+# Messages cached before timestamps were parsed to epochs
+LEGACY_MESSAGE_KEYS = tuple(k for k in MESSAGE_KEYS if k != 'epoch')
+
+
+class MessageTable(Sequence):
+    """Parsed messages stored column by column instead of as one dict each
+
+    Senders are interned as small integer ids, is_media and is_system are bits
+    of a flags byte and media paths are only kept for the messages that have
+    one. Indexing returns a fresh dict equal to the one appended; use
+    message_view() to read fields in place. Messages that don't have the
+    usual keys and types are kept exactly as given.
+    """
+
+    MEDIA = 1
+    SYSTEM = 2
+    NO_EPOCH_KEY = 4
+    IRREGULAR = 8
+    NO_EPOCH = -2 ** 63  # epoch column value of a timestamp that didn't parse
+
+    def __init__(self, messages=()):
+        self.sender_names = []
+        self._sender_ids = {}
+        self._timestamps = []
+        self._epochs = array('q')
+        self._senders = array('I')
+        self._texts = []
+        self._flags = array('B')
+        self._media_paths = {}
+        self._irregular = {}
+        self._count = 0
+        self.extend(messages)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('message index out of range')
+        return self._record(index)
+
+    def extend(self, messages):
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg):
+        index = len(self._texts)
+        keys = tuple(msg)
+        flags = 0
+        if keys == LEGACY_MESSAGE_KEYS:
+            flags = self.NO_EPOCH_KEY
+        elif keys != MESSAGE_KEYS:
+            flags = self.IRREGULAR
+        epoch = msg.get('epoch')
+        if not flags & self.IRREGULAR and not (
+                (epoch is None or type(epoch) is int) and type(msg['is_media']) is bool and
+                type(msg['is_system']) is bool and type(msg['sender']) is str):
+            flags = self.IRREGULAR
+
+        if flags & self.IRREGULAR:
+            self._irregular[index] = dict(msg)
+            self._timestamps.append('')
+            self._epochs.append(self.NO_EPOCH)
+            self._senders.append(0)
+            self._texts.append('')
+            self._flags.append(self.IRREGULAR | self.SYSTEM)
+        else:
+            sender = msg['sender']
+            sender_id = self._sender_ids.get(sender)
+            if sender_id is None:
+                sender_id = self._sender_ids[sender] = len(self.sender_names)
+                self.sender_names.append(sender)
+            if msg['is_media']:
+                flags |= self.MEDIA
+            if msg['is_system']:
+                flags |= self.SYSTEM
+            if msg['media_path'] is not None:
+                self._media_paths[index] = msg['media_path']
+            self._timestamps.append(msg['timestamp'])
+            self._epochs.append(self.NO_EPOCH if epoch is None else epoch)
+            self._senders.append(sender_id)
+            self._texts.append(msg['text'])
+            self._flags.append(flags)
+        # Readers only look below the count, so it goes up once every column has the message
+        self._count = index + 1
+
+    def keys_of(self, index):
+        flags = self._flags[index]
+        if flags & self.IRREGULAR:
+            return tuple(self._irregular[index])
+        return LEGACY_MESSAGE_KEYS if flags & self.NO_EPOCH_KEY else MESSAGE_KEYS
+
+    def field(self, index, key):
+        """One field of a message, raising KeyError like the message's dict would"""
+        flags = self._flags[index]
+        if flags & self.IRREGULAR:
+            return self._irregular[index][key]
+        if key == 'text':
+            return self._texts[index]
+        if key == 'sender':
+            return self.sender_names[self._senders[index]]
+        if key == 'is_system':
+            return bool(flags & self.SYSTEM)
+        if key == 'is_media':
+            return bool(flags & self.MEDIA)
+        if key == 'media_path':
+            return self._media_paths.get(index)
+        if key == 'timestamp':
+            return self._timestamps[index]
+        if key == 'epoch' and not flags & self.NO_EPOCH_KEY:
+            epoch = self._epochs[index]
+            return None if epoch == self.NO_EPOCH else epoch
+        raise KeyError(key)
+
+    def _record(self, index):
+        return {key: self.field(index, key) for key in self.keys_of(index)}
+
+
+class MessageView(Mapping):
+    """A stored message read in place, plus the _index (and on search pages _is_match) the renderer uses"""
+
+    __slots__ = ('_table', '_fields', 'index', 'is_match')
+
+    def __init__(self, source, index, is_match=None):
+        if isinstance(source, MessageTable):
+            self._table, self._fields = source, None
+        else:
+            self._table, self._fields = None, source
+        self.index = index
+        self.is_match = is_match
+
+    def __getitem__(self, key):
+        if key == '_index':
+            return self.index
+        if key == '_is_match':
+            if self.is_match is None:
+                raise KeyError(key)
+            return self.is_match
+        if self._fields is not None:
+            return self._fields[key]
+        return self._table.field(self.index, key)
+
+    def __iter__(self):
+        yield from self._fields if self._fields is not None else self._table.keys_of(self.index)
+        if self.is_match is not None:
+            yield '_is_match'
+        yield '_index'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def message_view(messages, index, is_match=None):
+    """messages[index] as a MessageView, without decoding or copying it when the columns allow"""
+    if isinstance(messages, MessageTable):
+        return MessageView(messages, index, is_match)
+    return MessageView(messages[index], index, is_match)
+
+
+class LoadedChat:
+    """A parsed chat held in memory together with the hash of its ZIP
+
+    While a first-time parse is running, ``messages`` is a MessageTable that
+    grows in batches and ``complete`` is False; once ingestion finishes it is replaced
+    by the cached copy and ``complete`` becomes True.
+    """
+
+    def __init__(self, zip_hash, messages, complete=True):
+        self.zip_hash = zip_hash
+        self.messages = messages
+        self.complete = complete
+        self.error = None
+        self._progress = threading.Condition()
+        self._lock = threading.Lock()
+        # Loaded on first use, by class
+        self._indexes = {}
+        self._search_results = OrderedDict()
+        # A chat being ingested counts its statistics as messages arrive
+        self._stats = None if complete else ChatStats()
+        # Its cached files are in use for as long as the chat is referenced from anywhere
+        CACHE_MANAGER.hold(zip_hash)
+        weakref.finalize(self, CACHE_MANAGER.release, zip_hash)
+
+    def publish(self, batch):
+        """Make freshly parsed messages visible to readers"""
+        self._stats.add(batch)
+        with self._progress:
+            self.messages.extend(batch)
+            self._progress.notify_all()
+
+    def finish(self, messages=None, error=None):
+        with self._progress:
+            if messages is not None:
+                self.messages = messages
+            self.error = error
+            self.complete = True
+            self._progress.notify_all()
+
+    def wait(self, count=None, timeout=None):
+        """Block until count messages are available or ingestion ends; return how many are available"""
+        with self._progress:
+            self._progress.wait_for(
+                lambda: self.complete or (count is not None and len(self.messages) >= count), timeout)
+        if self.error:
+            raise ValueError(self.error)
+        return len(self.messages)
+
+    def senders(self):
+        """Sorted names of everyone who sent a non-system message"""
+        return self.stats().senders()
+
+    def stats(self):
+        """The chat's ChatStats, loaded from disk or, for caches that predate them, counted once"""
+        with self._lock:
+            if self._stats is None:
+                stats_file = os.path.join(CACHE_DIR, f"{self.zip_hash}.stats.json")
+                stats = ChatStats.load(stats_file)
+                if stats is None:
+                    stats = ChatStats.build(self.messages)
+                    stats.save(stats_file)
+                self._stats = stats
+            return self._stats
+
+    def _index(self, cls, suffix):
+        with self._lock:
+            index = self._indexes.get(cls)
+            if index is None:
+                index = self._indexes[cls] = chat_index(cls, suffix, self.zip_hash, self.messages)
+            return index
+
+    def search_index(self):
+        return self._index(SearchIndex, 'search.idx')
+
+    def date_index(self):
+        return self._index(DateIndex, 'dates.idx')
+
+    def facet_index(self):
+        return self._index(FacetIndex, 'facets.idx')
+
+    def filter_messages(self, senders=(), types=(), start=None, end=None):
+        """Sorted indices of messages from any of senders, of any of types and dated in [start, end)
+
+        Empty senders or types and None bounds don't filter. A bounded date range
+        leaves out messages whose timestamp didn't parse.
+        """
+        key = ('filter', tuple(sorted(senders)), tuple(sorted(types)), start, end)
+        with self._lock:
+            result = self._search_results.get(key)
+            if result is not None:
+                self._search_results.move_to_end(key)
+        if result is not None:
+            return result
+
+        messages = self.messages
+        if not self.complete:
+            # Still ingesting: no posting lists yet, so check what has arrived
+            senders, types = set(senders), set(types)
+            result = []
+            for i in range(len(messages)):
+                msg = message_view(messages, i)
+                epoch = msg.get('epoch')
+                if ((not senders or msg.get('sender') in senders) and
+                        (not types or message_type(msg) in types) and
+                        (start is None or (epoch is not None and epoch >= start)) and
+                        (end is None or (epoch is not None and epoch < end))):
+                    result.append(i)
+            return result
+
+        with METRICS.stage('filter'):
+            lists = []
+            if senders:
+                lists.append(self.facet_index().union('sender', senders))
+            if types:
+                lists.append(self.facet_index().union('type', types))
+            if start is not None or end is not None:
+                lists.append(self.date_index().between(start, end))
+            result = intersect_sorted(lists) if lists else list(range(len(messages)))
+
+        with self._lock:
+            self._search_results[key] = result
+            while len(self._search_results) > SEARCH_RESULTS_PER_CHAT:
+                self._search_results.popitem(last=False)
+        return result
+
+    def first_on_or_after(self, epoch):
+        """Index of the earliest message at or after epoch, or None"""
+        if self.complete:
+            return self.date_index().first_on_or_after(epoch)
+        # Still ingesting: no index yet, so look through what has arrived
+        messages = self.messages
+        best = None
+        for i in range(len(messages)):
+            e = message_view(messages, i).get('epoch')
+            if e is not None and e >= epoch and (best is None or e < best[0]):
+                best = (e, i)
+        return best[1] if best else None
+
+    def find_matches(self, query):
+        """Sorted indices of messages whose text or sender contains query (case-insensitive)"""
+        q = query.strip().lower()
+        if not q:
+            return []
+        with self._lock:
+            matches = self._search_results.get(q)
+            if matches is not None:
+                self._search_results.move_to_end(q)
+        METRICS.cache_lookup('search_results', matches is not None)
+        if matches is not None:
+            return matches
+
+        messages = self.messages
+        if not self.complete:
+            # The index is only built once ingestion ends; scan what has arrived so far
+            with METRICS.stage('search_scan'):
+                return [i for i in range(len(messages)) if q in search_haystack(message_view(messages, i))]
+
+        index = self.search_index()
+        with METRICS.stage('search'):
+            candidates = index.candidates(q)
+            if candidates is None:
+                candidates = range(len(messages))
+            matches = [i for i in candidates if q in search_haystack(message_view(messages, i))]
+
+        with self._lock:
+            self._search_results[q] = matches
+            while len(self._search_results) > SEARCH_RESULTS_PER_CHAT:
+                self._search_results.popitem(last=False)
+        return matches
+
+    def find_pattern_matches(self, mode, query, needed, max_distance=0):
+        """Sorted indices of at least the first needed messages matching a regex or fuzzy query
+
+        Returns (matches, done) where done means every available message was
+        scanned. A later call for the same query resumes where this one stopped.
+        """
+        key = (mode, query, max_distance)
+        # Messages are only ever appended, so a scanned prefix stays valid while ingesting
+        with keyed_lock(('pattern', self.zip_hash, key)):
+            with self._lock:
+                state = self._search_results.get(key)
+                if state is not None:
+                    self._search_results.move_to_end(key)
+            METRICS.cache_lookup('search_results', state is not None)
+            matches, scanned = state or ([], 0)
+            messages = self.messages
+            total = len(messages)
+            if len(matches) < needed and scanned < total:
+                with METRICS.stage('pattern_search'):
+                    found, scanned = scan_pattern(messages, scanned, total, mode, query, max_distance,
+                                                  needed - len(matches))
+                # A new list, so callers still holding the previous one never see it change
+                matches = matches + found
+                with self._lock:
+                    self._search_results[key] = (matches, scanned)
+                    while len(self._search_results) > SEARCH_RESULTS_PER_CHAT:
+                        self._search_results.popitem(last=False)
+        return matches, scanned >= total
+
+
+class ChatStore:
+    """Bounded LRU of parsed chats keyed by ZIP fingerprint"""
+
+    def __init__(self, max_chats=CHAT_STORE_MAX_CHATS, max_messages=CHAT_STORE_MAX_MESSAGES):
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._chats)
+
+    def get(self, fingerprint):
+        with self._lock:
+            chat = self._chats.get(fingerprint)
+            if chat is not None:
+                self._chats.move_to_end(fingerprint)
+            return chat
+
+    def peek(self, fingerprint):
+        """get() without marking the chat as recently used"""
+        with self._lock:
+            return self._chats.get(fingerprint)
+
+    def put(self, fingerprint, chat):
+        with self._lock:
+            # A changed ZIP at the same path makes older entries for that path unreachable
+            for stale in [k for k in self._chats if k[0] == fingerprint[0] and k != fingerprint]:
+                del self._chats[stale]
+            self._chats[fingerprint] = chat
+            self._chats.move_to_end(fingerprint)
+            self._evict()
+
+    def discard(self, fingerprint):
+        with self._lock:
+            self._chats.pop(fingerprint, None)
+
+    def clear(self):
+        with self._lock:
+            self._chats.clear()
+
+    def _evict(self):
+        # Always keep the most recently used chat, even if it alone exceeds the budget
+        while len(self._chats) > 1 and (
+                len(self._chats) > self.max_chats or
+                sum(len(c.messages) for c in self._chats.values()) > self.max_messages):
+            self._chats.popitem(last=False)
+
+
+CHAT_STORE = ChatStore()
+
+
+# ----------------------------
+# Incremental import
+# ----------------------------
+
+class ChatFingerprint:
+    """Running MD5 of a chat's text lines, saved beside its cache to recognise later exports of the chat
+
+    A re-export of a chat starts with exactly the lines of the previous one.
+    ``head`` hashes the first FINGERPRINT_HEAD_LINES lines to find candidates,
+    ``checkpoints`` (every FINGERPRINT_CHECKPOINT_LINES lines) reject a mismatch
+    early and ``digest`` covers every line. The media lookups made while parsing
+    are kept too: reused messages are only right if the new export resolves them alike.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.lines = 0
+        self.head = None
+        self.checkpoints = []
+        self.messages = 0
+        self.lookups = {}
+        self.first_media = None
+        self.first_media_used = False
+        self._md5 = hashlib.md5()
+        self._digest = None
+
+    def update(self, line):
+        self._md5.update(line.encode('utf-8'))
+        self.lines += 1
+        if self.lines == FINGERPRINT_HEAD_LINES:
+            self.head = self._md5.hexdigest()
+        if self.lines % FINGERPRINT_CHECKPOINT_LINES == 0:
+            self.checkpoints.append(self._md5.hexdigest())
+
+    def update_text(self, text):
+        """update() for a block of whole lines at once, as read from a text file"""
+        pos = 0
+        while pos < len(text):
+            if self.lines < FINGERPRINT_HEAD_LINES:
+                due = FINGERPRINT_HEAD_LINES - self.lines
             else:
-                if current_msg:
-                    current_msg['text'] += '\n' + line
+                due = FINGERPRINT_CHECKPOINT_LINES - self.lines % FINGERPRINT_CHECKPOINT_LINES
+            # Hash up to the line that completes the head or a checkpoint, or all the rest if none does
+            end = len(text)
+            if text.count('\n', pos) >= due:
+                end = pos
+                for _ in range(due):
+                    end = text.find('\n', end) + 1
+            block = text[pos:end]
+            self._md5.update(block.encode('utf-8'))
+            self.lines += block.count('\n') + (not block.endswith('\n'))
+            if self.lines == FINGERPRINT_HEAD_LINES:
+                self.head = self._md5.hexdigest()
+            if self.lines % FINGERPRINT_CHECKPOINT_LINES == 0:
+                self.checkpoints.append(self._md5.hexdigest())
+            pos = end
+
+    def reading(self, lines):
+        """Pass lines through, hashing each one"""
+        for line in lines:
+            self.update(line)
+            yield line
+
+    @property
+    def digest(self):
+        return self._digest or self._md5.hexdigest()
+
+    @staticmethod
+    def path(zip_hash, head):
+        # The head is part of the name so candidates are found without opening every fingerprint
+        return os.path.join(CACHE_DIR, f'{zip_hash}.{head}.prefix.json')
+
+    def save(self, zip_hash):
+        if self.head is None:
+            # Shorter than FINGERPRINT_HEAD_LINES: too small to be worth importing incrementally
+            return
+        data = {'version': self.VERSION, 'lines': self.lines, 'head': self.head, 'checkpoints': self.checkpoints,
+                'digest': self.digest, 'messages': self.messages, 'lookups': self.lookups,
+                'first_media': self.first_media, 'first_media_used': self.first_media_used}
+        with atomic_write(self.path(zip_hash, self.head), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, fingerprint_file):
+        try:
+            with open(fingerprint_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION:
+                return None
+            fingerprint = cls()
+            fingerprint.lines = data['lines']
+            fingerprint.head = data['head']
+            fingerprint.checkpoints = data['checkpoints']
+            fingerprint._digest = data['digest']
+            fingerprint.messages = data['messages']
+            fingerprint.lookups = data['lookups']
+            fingerprint.first_media = data['first_media']
+            fingerprint.first_media_used = data['first_media_used']
+            return fingerprint
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+class RecordingMediaIndex:
+    """Wraps a MediaIndex, noting in a ChatFingerprint every lookup the parser makes"""
+
+    def __init__(self, media_index, fingerprint):
+        self._index = media_index
+        self._fingerprint = fingerprint
+        fingerprint.first_media = media_index.first_media
+
+    @property
+    def first_media(self):
+        self._fingerprint.first_media_used = True
+        return self._index.first_media
+
+    def find(self, fname):
+        result = self._fingerprint.lookups[fname] = self._index.find(fname)
+        return result
+
+
+def find_base_export(head, zip_hash):
+    """(hash, ChatFingerprint) of the longest other cached export whose first lines hash to head, or None"""
+    best = None
+    suffix = f'.{head}.prefix.json'
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(suffix) or name.startswith(zip_hash):
+            continue
+        base_hash = name[:-len(suffix)]
+        if not os.path.exists(os.path.join(CACHE_DIR, f'{base_hash}.msgs')):
+            continue
+        fingerprint = ChatFingerprint.load(os.path.join(CACHE_DIR, name))
+        # The timestamp dialect must have been settled within the shared lines
+        if fingerprint is None or fingerprint.messages < DIALECT_SAMPLE_HEADERS:
+            continue
+        if best is None or fingerprint.lines > best[1].lines:
+            best = (base_hash, fingerprint)
+    return best
+
+
+def _import_incremental(chat, lines, media_index):
+    """Build a new export's cache from an older cached export of the same chat plus the new tail
+
+    Only the lines after the older export's are parsed; its message records are
+    copied and its statistics and indexes extended. Returns the new MessageFile, or
+    None when no cached export is a prefix of this one and the chat must be parsed in full.
+    """
+    if CACHE_FORMAT != 'binary':
+        return None
+    fingerprint = ChatFingerprint()
+    lines = fingerprint.reading(lines)
+    head = list(itertools.islice(lines, FINGERPRINT_HEAD_LINES))
+    if fingerprint.head is None:
+        return None
+    found = find_base_export(fingerprint.head, chat.zip_hash)
+    if found is None:
+        return None
+    base_hash, base = found
+
+    # Hash the rest of the shared lines, giving up at the first checkpoint that differs
+    samples = []
+    for line in itertools.chain(head, itertools.islice(lines, base.lines - fingerprint.lines)):
+        if len(samples) < DIALECT_SAMPLE_HEADERS:
+            match = _match_header(_clean_line(line))
+            if match:
+                samples.append(match.group('ts').strip())
+        checkpoints = len(fingerprint.checkpoints)
+        if checkpoints and fingerprint.checkpoints[-1] != base.checkpoints[checkpoints - 1]:
+            return None
+    if fingerprint.lines != base.lines or fingerprint.digest != base.digest:
+        return None
+    if any(media_index.find(fname) != path for fname, path in base.lookups.items()):
+        return None
+    if base.first_media_used and media_index.first_media != base.first_media:
+        return None
+
+    # The older export's last message must be complete: the next line has to start a new one
+    tail_lines = (line for line in lines if _clean_line(line).strip())
+    first = next(tail_lines, None)
+    if first is not None and not _match_header(_clean_line(first)):
+        return None
+    fingerprint.lookups = dict(base.lookups)
+    fingerprint.first_media_used = base.first_media_used
+    recorder = RecordingMediaIndex(media_index, fingerprint)
+    tail = []
+    if first is not None:
+        tail = list(parse_chat_lines(itertools.chain([first], tail_lines), recorder,
+                                     TimestampDialect.detect(samples)))
+
+    zip_hash = chat.zip_hash
+    with CACHE_MANAGER.pinned(base_hash):
+        old = MessageFile(os.path.join(CACHE_DIR, f'{base_hash}.msgs'))
+        offset = len(old)
+        if offset != base.messages:
+            return None
+        cache_file = os.path.join(CACHE_DIR, f'{zip_hash}.msgs')
+        MessageFile.write(cache_file, tail, base=old)
+
+        stats = ChatStats.load(os.path.join(CACHE_DIR, f'{base_hash}.stats.json')) or ChatStats.build(old)
+        stats.add(tail)
+        stats.save(os.path.join(CACHE_DIR, f'{zip_hash}.stats.json'))
+        for cls, suffix in CHAT_INDEXES:
+            index = chat_index(cls, suffix, base_hash, old)
+            index.extended(cls.build(tail), offset).save(os.path.join(CACHE_DIR, f'{zip_hash}.{suffix}'))
+
+    fingerprint.messages = offset + len(tail)
+    fingerprint.save(zip_hash)
+    # Nothing was published while importing, so the chat's statistics are the merged ones
+    chat._stats = stats
+    return MessageFile(cache_file)
+
 
-        if current_msg:
-            yield current_msg
+# ----------------------------
+# Parsed chat cache
+# ----------------------------
 
+class MessageFile(Sequence):
+    """Read-only, memory-mapped view of a binary message cache
+
+    Layout (little-endian): magic, uint64 message count, a table of count + 1
+    uint64 record offsets, then one record per message: a uint32 length
+    followed by the message as UTF-8 JSON. Only the records that are indexed
+    or sliced get decoded.
+    """
 
+    MAGIC = b'WAMSGS1\n'
+
+    def __init__(self, cache_file):
+        with open(cache_file, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f'Not a message cache: {cache_file}')
+        self.path = os.path.abspath(cache_file)
+        self._count, = struct.unpack_from('<Q', self._buf, len(self.MAGIC))
+        self._table = len(self.MAGIC) + 8
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('message index out of range')
+        return self._record(index)
+
+    def _record(self, index):
+        offset, = struct.unpack_from('<Q', self._buf, self._table + 8 * index)
+        length, = struct.unpack_from('<I', self._buf, offset)
+        return json.loads(self._buf[offset + 4:offset + 4 + length].decode('utf-8'))
+
+    @classmethod
+    def write(cls, cache_file, messages, base=None):
+        """Write messages as a cache file, after every record of base (a MessageFile) if given"""
+        base_count = len(base) if base is not None else 0
+        with atomic_write(cache_file) as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<Q', base_count + len(messages)))
+            table_pos = f.tell()
+            f.write(bytes(8 * (base_count + len(messages) + 1)))
+            offsets = array('Q')
+            if base_count:
+                # Base records are copied byte for byte; only their offsets move
+                base_offsets = array('Q')
+                base_offsets.frombytes(base._buf[base._table:base._table + 8 * (base_count + 1)])
+                if sys.byteorder != 'little':
+                    base_offsets.byteswap()
+                shift = f.tell() - base_offsets[0]
+                offsets.extend(offset + shift for offset in base_offsets[:-1])
+                for pos in range(base_offsets[0], base_offsets[-1], 16 * 1024 * 1024):
+                    f.write(base._buf[pos:min(pos + 16 * 1024 * 1024, base_offsets[-1])])
+            for msg in messages:
+                offsets.append(f.tell())
+                data = json.dumps(msg, ensure_ascii=False).encode('utf-8')
+                f.write(struct.pack('<I', len(data)))
+                f.write(data)
+            offsets.append(f.tell())
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            f.seek(table_pos)
+            offsets.tofile(f)
+
+
+@timed_stage('cache_write')
 def cache_chat(zip_path, messages):
-    zip_hash = compute_file_hash(zip_path)
+    zip_hash = get_zip_hash(zip_path)
+    if CACHE_FORMAT == 'binary':
+        cache_file = os.path.join(CACHE_DIR, f"{zip_hash}.msgs")
+        MessageFile.write(cache_file, messages)
+        return cache_file
     cache_file = os.path.join(CACHE_DIR, f"{zip_hash}.json")
-    with open(cache_file, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, ensure_ascii=False)
+    with atomic_write(cache_file, 'w', encoding='utf-8') as f:
+        # Same text as json.dump(list(messages)), without materializing every message at once
+        f.write('[')
+        for i, msg in enumerate(messages):
+            if i:
+                f.write(', ')
+            f.write(json.dumps(msg, ensure_ascii=False))
+        f.write(']')
     return cache_file
 
 
+@timed_stage('cache_load')
 def load_cached_chat(zip_path):
-    zip_hash = compute_file_hash(zip_path)
-    cache_file = os.path.join(CACHE_DIR, f"{zip_hash}.json")
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    zip_hash = get_zip_hash(zip_path)
+    binary_file = os.path.join(CACHE_DIR, f"{zip_hash}.msgs")
+    json_file = os.path.join(CACHE_DIR, f"{zip_hash}.json")
+    if CACHE_FORMAT == 'binary' and not os.path.exists(binary_file) and os.path.exists(json_file):
+        # Migrate a cache written before the binary format existed
+        with open(json_file, 'r', encoding='utf-8') as f:
+            MessageFile.write(binary_file, json.load(f))
+        os.remove(json_file)
+    if CACHE_FORMAT == 'json' and os.path.exists(json_file):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            return MessageTable(json.load(f))
+    if os.path.exists(binary_file):
+        return MessageFile(binary_file)
     return None
 
 
+def export_chat_json(zip_path, out_file):
+    """Write a chat's parsed messages as a plain JSON array, whatever the cache format"""
+    with open(out_file, 'w', encoding='utf-8') as f:
+        json.dump(list(extract_and_parse(zip_path)), f, ensure_ascii=False)
+
+
+def load_chat(zip_path, wait=True, store=True):
+    """Return the LoadedChat for a ZIP, parsing it only when neither memory nor disk has it
+
+    A cold chat is parsed on a background thread. With wait=False the chat is
+    returned straight away and fills up while the caller pages through it. With
+    store=False a chat not already in CHAT_STORE is loaded without being added
+    to it (or making its other chats older), so a one-off read evicts nothing.
+    """
+    fingerprint = file_fingerprint(zip_path)
+    chat = CHAT_STORE.get(fingerprint) if store else CHAT_STORE.peek(fingerprint)
+    METRICS.cache_lookup('chat_store', chat is not None)
+    if chat is None:
+        zip_hash = get_zip_hash(zip_path)
+        # Single flight: concurrent requests for the same export share one load or parse
+        with keyed_lock(('chat', zip_hash)):
+            chat = CHAT_STORE.get(fingerprint) or _in_flight.get(zip_hash)
+            if chat is None:
+                cached = load_cached_chat(zip_path)
+                METRICS.cache_lookup('parsed_chat', cached is not None)
+                if cached is not None:
+                    chat = LoadedChat(zip_hash, cached)
+                else:
+                    chat = LoadedChat(zip_hash, MessageTable(), complete=False)
+                    _in_flight[zip_hash] = chat
+                    threading.Thread(target=_ingest, args=(chat, zip_path, fingerprint),
+                                     name=f'ingest-{zip_hash[:8]}', daemon=True).start()
+            if store:
+                CHAT_STORE.put(fingerprint, chat)
+    CACHE_MANAGER.touch(chat.zip_hash)
+    if wait:
+        chat.wait()
+    return chat
+
+
 def extract_and_parse(zip_path):
-    try:
-        cached = load_cached_chat(zip_path)
-        if cached is not None:
-            return cached
-
-        # Create a unique extraction directory for each zip using its hash
-        zip_hash = compute_file_hash(zip_path)
-        extract_dir = os.path.join(CACHE_DIR, f'extract_{zip_hash}')
-        
-        # Only extract if not already extracted
-        if not os.path.exists(extract_dir):
-            os.makedirs(extract_dir, exist_ok=True)
+    return load_chat(zip_path).messages
 
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            zf.extractall(extract_dir)
 
-        chat_file = find_chat_file_in_dir(extract_dir)
-        chat_dir = os.path.dirname(chat_file)
-        messages = list(parse_chat_streaming(chat_file, chat_dir))
-        cache_chat(zip_path, messages)
-        return messages
+# Chats whose first parse is running, by ZIP hash (even if the store has already evicted them)
+_in_flight = {}
+
+
+def _ingest(chat, zip_path, fingerprint):
+    try:
+        # Only one server process parses an export; the others wait here and load its cache
+        ingest_lock = lock_export_file(chat.zip_hash, 'ingest')
+        try:
+            messages = load_cached_chat(zip_path)
+            if messages is not None:
+                # Counted by the process that parsed it; stats() loads the saved copy
+                chat._stats = None
+            else:
+                messages = _extract_and_publish(chat, zip_path)
+        finally:
+            ingest_lock.close()
     except zipfile.BadZipFile:
-        raise ValueError('Invalid or corrupted ZIP file')
+        CHAT_STORE.discard(fingerprint)
+        chat.finish(error='Invalid or corrupted ZIP file')
+    except Exception as e:
+        CHAT_STORE.discard(fingerprint)
+        chat.finish(error=str(e) or type(e).__name__)
+    else:
+        chat.finish(messages)
+    finally:
+        _in_flight.pop(chat.zip_hash, None)
+
+
+def extract_zip(zip_path, zip_hash):
+    """Extract a whole ZIP to .cache/extract_<hash>, skipping it if a complete extraction exists"""
+    extract_dir = os.path.join(CACHE_DIR, f'extract_{zip_hash}')
+    if not os.path.isdir(extract_dir):
+        # Extract beside the final name and rename, so a half-finished extraction is never reused
+        partial_dir = f'{extract_dir}.partial-{os.getpid()}'
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        with METRICS.stage('extractall'), zipfile.ZipFile(zip_path, 'r') as zf:
+            zf.extractall(partial_dir)
+        os.replace(partial_dir, extract_dir)
+    return extract_dir
+
+
+def extracted_path(zip_hash, member):
+    """Where extractall() puts a ZIP member: under .cache/extract_<hash>, with drive, '..' and '.' parts dropped"""
+    name = member.replace('/', os.sep)
+    if os.altsep:
+        name = name.replace(os.altsep, os.sep)
+    parts = [part for part in os.path.splitdrive(name)[1].split(os.sep) if part not in ('', os.curdir, os.pardir)]
+    if not parts:
+        raise FileNotFoundError(f'Unusable ZIP member name: {member!r}')
+    return os.path.join(CACHE_DIR, f'extract_{zip_hash}', *parts)
+
+
+def extract_member(zip_path, zip_hash, member):
+    """Extract one member to .cache/extract_<hash> unless it is already there; return its path"""
+    target = extracted_path(zip_hash, member)
+    if not os.path.isfile(target):
+        with keyed_lock(('extract', target)):
+            if not os.path.isfile(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with METRICS.stage('extract_member'), zipfile.ZipFile(zip_path, 'r') as zf, zf.open(member) as src, atomic_write(target) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+    return target
+
+
+@contextlib.contextmanager
+def open_chat_source(zip_path, zip_hash):
+    """Yield (lines of the chat .txt, MediaIndex) according to EXTRACT_MODE"""
+    # The media listing only changes with the ZIP, so keep it beside the parsed cache
+    media_index_file = os.path.join(CACHE_DIR, f"{zip_hash}.media.json")
+    media_index = MediaIndex.load(media_index_file)
+
+    if EXTRACT_MODE == 'full':
+        chat_file = find_chat_file_in_dir(extract_zip(zip_path, zip_hash))
+        chat_dir = os.path.dirname(chat_file)
+        if media_index is None:
+            media_index = MediaIndex.build(chat_dir)
+            media_index.save(media_index_file)
+        with open(chat_file, 'r', encoding='utf-8', errors='replace') as f:
+            yield f, media_index
+        return
+
+    members = get_zip_members(zip_path)
+    if media_index is None:
+        media_index = members.media_index()
+        media_index.save(media_index_file)
+    with zipfile.ZipFile(zip_path, 'r') as zf, zf.open(members.chat_member) as raw:
+        yield io.TextIOWrapper(raw, encoding='utf-8', errors='replace'), media_index
+
+
+def _extract_and_publish(chat, zip_path):
+    zip_hash = chat.zip_hash
+    if INCREMENTAL_IMPORT:
+        with METRICS.stage('incremental_import'), open_chat_source(zip_path, zip_hash) as (lines, media_index):
+            messages = _import_incremental(chat, lines, media_index)
+        if messages is not None:
+            return messages
+
+    fingerprint = ChatFingerprint()
+    batch = []
+    with METRICS.stage('parse_chat'), open_chat_source(zip_path, zip_hash) as (lines, media_index):
+        chat_file = parallel_parse_file(zip_path, zip_hash)
+        if chat_file is not None:
+            parsed = parse_chat_parallel(chat_file, media_index, fingerprint)
+        else:
+            parsed = parse_chat_lines(fingerprint.reading(lines), RecordingMediaIndex(media_index, fingerprint))
+        for msg in parsed:
+            batch.append(msg)
+            if len(batch) >= INGEST_PUBLISH_EVERY:
+                chat.publish(batch)
+                batch = []
+    chat.publish(batch)
+
+    messages = chat.messages
+    cache_file = cache_chat(zip_path, messages)
+    chat.stats().save(os.path.join(CACHE_DIR, f"{zip_hash}.stats.json"))
+    for cls, suffix in CHAT_INDEXES:
+        chat_index(cls, suffix, zip_hash, messages, rebuild=True)
+    fingerprint.messages = len(messages)
+    fingerprint.save(zip_hash)
+    if CACHE_FORMAT == 'binary':
+        # Serve from the mapped file so the parsed columns can be freed
+        return MessageFile(cache_file)
+    return messages
+
+
+HIGHLIGHT_MARK = r"<mark style=\"background:#005c4b;color:white;padding:0 2px;border-radius:2px;\">\1</mark>"
+
+
+@functools.lru_cache(maxsize=64)
+def _highlight_pattern(query):
+    return re.compile(f'({re.escape(query)})', flags=re.IGNORECASE)
 
 
 def highlight_text(text, query):
     if not query or not text:
         return html.escape(text).replace('\n', '<br>')
     escaped = html.escape(text)
-    highlighted = re.sub(f'({re.escape(query)})',
-                         r"<mark style=\"background:#005c4b;color:white;padding:0 2px;border-radius:2px;\">\1</mark>",
-                         escaped, flags=re.IGNORECASE)
+    highlighted = _highlight_pattern(query).sub(HIGHLIGHT_MARK, escaped)
     return highlighted.replace('\n', '<br>')
 
 
-def render_message_html_with_highlight(messages, query):
-    out = ''
+def _legacy_clock(timestamp):
+    # Caches written before messages carried 'epoch'
+    for fmt in ['%m/%d/%y, %I:%M:%S %p', '%d/%m/%Y, %H:%M', '%d/%m/%y, %I:%M %p']:
+        try:
+            return datetime.strptime(timestamp, fmt).strftime('%I:%M %p')
+        except Exception:
+            continue
+    return timestamp
+
+
+@timed_stage('render')
+def render_message_html_with_highlight(messages, query, file_name=None):
+    # Tag media URLs with their export so /exports/ can find them without searching every extraction
+    media_suffix = f'?file={urllib.parse.quote(file_name)}' if file_name else ''
+    escape = html.escape
+    parts = []
+    append = parts.append
     for msg in messages:
         if msg.get('is_system'):
-            out += f"<div class=\"system\">{html.escape(msg.get('text', ''))}</div>"
+            append(f"<div class=\"system\">{escape(msg.get('text', ''))}</div>")
             continue
 
         is_match = msg.get('_is_match', False)
         bubble_class = 'bubble' + (' match-bubble' if is_match else '')
-        sender = html.escape(msg.get('sender', ''))
+        sender = escape(msg.get('sender', ''))
         index_attr = f' id="msg-{msg.get("_index")}" data-index="{msg.get("_index")}"' if '_index' in msg else ''
-        out += f'<div class="message received" data-sender="{sender}"{index_attr}>'
-        out += f'<div class="{bubble_class}">'
-        out += f'<div class="sender">{sender}</div>'
+        append(f'<div class="message received" data-sender="{sender}"{index_attr}>'
+               f'<div class="{bubble_class}"><div class="sender">{sender}</div>')
 
         if msg.get('is_media') and msg.get('media_path'):
             ext = os.path.splitext(msg['media_path'])[1].lower()
-            src = '/exports/' + msg['media_path']
+            src = '/exports/' + msg['media_path'] + media_suffix
             if ext in ('.jpg', '.jpeg', '.png', '.gif', '.webp'):
-                out += f'<img src="{src}" class="media" alt="Media">'
+                append(f'<img src="{src}" class="media" alt="Media">')
             elif ext in ('.mp4', '.mov', '.3gp'):
-                out += f'<video controls class="media"><source src="{src}" type="video/mp4">Video</video>'
+                append(f'<video controls class="media"><source src="{src}" type="video/mp4">Video</video>')
             else:
-                out += f'<a href="{src}" style="color:#00a884;">📎 Media</a>'
+                append(f'<a href="{src}" style="color:#00a884;">📎 Media</a>')
         else:
             text_str = msg.get('text', '') or ''
-            escaped_html = html.escape(text_str).replace('\n', '<br>')
-            out += f'<div class="message-text">{escaped_html}</div>'
+            escaped_html = escape(text_str).replace('\n', '<br>')
+            append(f'<div class="message-text">{escaped_html}</div>')
             if query:
-                out += highlight_text(msg.get('text', ''), query)
+                append(highlight_text(msg.get('text', ''), query))
 
-        if msg.get('_is_match'):
+        if is_match:
             idx = msg.get('_index', '')
             if idx != '':
-                out += f'<div style="margin-top:6px;font-size:12px;"><a href="#" onclick="goToMessage({idx});return false;" style="color:#00a884;">View in chat</a></div>'
+                append(f'<div style="margin-top:6px;font-size:12px;"><a href="#" onclick="goToMessage({idx});return false;" style="color:#00a884;">View in chat</a></div>')
 
-        out += '</div></div>'
+        if 'epoch' in msg:
+            epoch = msg['epoch']
+            time_str = format_clock(epoch) if epoch is not None else msg['timestamp']
+        else:
+            time_str = _legacy_clock(msg['timestamp'])
+        append(f'</div></div><div class="timestamp">{escape(str(time_str))}</div>')
 
-        try:
-            for fmt in ['%m/%d/%y, %I:%M:%S %p', '%d/%m/%Y, %H:%M', '%d/%m/%y, %I:%M %p']:
-                try:
-                    dt = datetime.strptime(msg['timestamp'], fmt)
-                    time_str = dt.strftime('%I:%M %p')
-                    break
-                except Exception:
-                    continue
-            else:
-                time_str = msg['timestamp']
-        except Exception:
-            time_str = msg['timestamp']
-        out += f'<div class="timestamp">{html.escape(str(time_str))}</div>'
+    return ''.join(parts)
+
+
+class FragmentCache:
+    """Bounded LRU of rendered /api/messages pages, limited by the memory their HTML takes"""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fragments)
 
-    return out
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._fragments.move_to_end(key)
+        METRICS.cache_lookup('fragments', entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, html_text):
+        """Remember value, whose size is taken to be that of the html_text it carries"""
+        size = sys.getsizeof(html_text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._fragments.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._fragments[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._fragments.popitem(last=False)
+                self._size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+
+
+FRAGMENT_CACHE = FragmentCache()
 
 
 def render_file_selector(zip_files):
@@ -302,11 +2516,344 @@ def render_chat_page(display_name, zip_filename, total_messages, current_page, s
     return page
 
 
+# ----------------------------
+# Search across exports
+# ----------------------------
+
+# Exports being loaded or searched for /api/search_all, across all of its requests
+_search_all_slots = threading.BoundedSemaphore(SEARCH_ALL_CONCURRENCY)
+
+
+def search_export(file_name, query, mode='substring', max_distance=0, per_file=SEARCH_ALL_PER_FILE,
+                  timeout=SEARCH_ALL_TIMEOUT_SECONDS):
+    """One export's /api/search_all result: its match count and first per_file matches
+
+    The chat is not added to CHAT_STORE. An export still parsing after timeout
+    seconds is reported as timed out, but only once its parse has finished, so
+    the caller's slot stays taken and timed-out exports never pile up parses.
+    """
+    chat = load_chat(os.path.join(EXPORTS_DIR, file_name), wait=False, store=False)
+    chat.wait(timeout=timeout)
+    if not chat.complete:
+        # A later search will find it cached
+        chat.wait()
+        return {'file': file_name, 'error': 'timeout'}
+    if mode == 'substring':
+        matches, done = chat.find_matches(query), True
+    else:
+        matches, done = chat.find_pattern_matches(mode, query, per_file, max_distance)
+    messages = chat.messages
+    hits = []
+    for i in matches[:per_file]:
+        msg = message_view(messages, i)
+        hits.append({'index': i, 'timestamp': msg.get('timestamp', ''), 'sender': msg.get('sender', ''),
+                     'text': msg.get('text', '')})
+    return {'file': file_name, 'total_matches': len(matches), 'partial': not done, 'matches': hits}
+
+
+def search_all_exports(query, mode='substring', max_distance=0, files=None, per_file=SEARCH_ALL_PER_FILE,
+                       limit=SEARCH_ALL_LIMIT, timeout=SEARCH_ALL_TIMEOUT_SECONDS, cancelled=None):
+    """Search every export, yielding each one's result as soon as it is ready, then a summary
+
+    At most SEARCH_ALL_CONCURRENCY exports are loaded and searched at a time, by
+    all searches together. One that takes longer than timeout seconds is reported
+    as timed out and left to finish its parse, keeping its slot until then.
+    Exports not started yet are dropped once limit matches have been yielded or
+    when cancelled (a threading.Event) is set. The summary's done is only true
+    when every export was searched or failed.
+    """
+    files = get_zip_files() if files is None else files
+    cancelled = cancelled or threading.Event()
+    started = {}
+
+    def run(file_name):
+        while not _search_all_slots.acquire(timeout=0.25):
+            if cancelled.is_set():
+                return None
+        try:
+            if cancelled.is_set():
+                return None
+            started[file_name] = time.monotonic()
+            return search_export(file_name, query, mode, max_distance, per_file, timeout)
+        except Exception as e:
+            return {'file': file_name, 'error': str(e)}
+        finally:
+            _search_all_slots.release()
+
+    pool = ThreadPoolExecutor(SEARCH_ALL_CONCURRENCY)
+    futures = {pool.submit(run, file_name): file_name for file_name in files}
+    pending = set(futures)
+    summary = {'done': False, 'files': len(files), 'searched': 0, 'failed': 0, 'timed_out': 0, 'returned': 0,
+               'limited': False, 'cancelled': False}
+    try:
+        while pending and not cancelled.is_set():
+            finished, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                if result is None:
+                    continue
+                if result.get('error') == 'timeout':
+                    summary['timed_out'] += 1
+                elif 'error' in result:
+                    summary['failed'] += 1
+                else:
+                    summary['searched'] += 1
+                hits = result.get('matches', [])
+                del hits[limit - summary['returned']:]
+                summary['returned'] += len(hits)
+                yield result
+                if summary['returned'] >= limit:
+                    summary['limited'] = True
+                    cancelled.set()
+                    break
+            now = time.monotonic()
+            for future in list(pending):
+                file_name = futures[future]
+                if file_name in started and now - started[file_name] > timeout:
+                    pending.discard(future)
+                    summary['timed_out'] += 1
+                    yield {'file': file_name, 'error': 'timeout'}
+    finally:
+        if pending:
+            # Stopped early: searches still waiting for a slot give up
+            cancelled.set()
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+    summary['cancelled'] = cancelled.is_set() and not summary['limited']
+    summary['done'] = summary['searched'] + summary['failed'] == len(files)
+    yield summary
+
+
 # ----------------------------
 # HTTP Handler
 # ----------------------------
 
+MEDIA_CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/mp4',
+    '.3gp': 'video/mp4',
+    '.mp3': 'audio/mpeg',
+    '.opus': 'audio/mpeg',
+}
+
+
+def media_content_type(path):
+    return MEDIA_CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+
+
+def _has_fileno(f):
+    try:
+        f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header, size):
+    """Return the inclusive (start, end) of a single-range 'bytes=' header, or None to send everything
+
+    Malformed and multi-range headers are ignored, as RFC 7233 allows. Raises
+    RangeNotSatisfiable when the range starts past the end of the file.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+# Content codings we can produce, in order of preference when the client rates several equally
+CONTENT_ENCODINGS = (('zstd',) if zstd else ()) + ('gzip', 'deflate')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the content coding to use for an Accept-Encoding header, or None to send the body as is"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        q = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best = None
+    for encoding in CONTENT_ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, encoding)
+    return best[1] if best else None
+
+
+def compress_body(body, encoding, level=COMPRESS_LEVEL):
+    with METRICS.stage('compress'):
+        if encoding == 'zstd':
+            return zstd.compress(body)
+        # wbits 31 writes a gzip container, 15 the zlib one HTTP calls "deflate"
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+        return compressor.compress(body) + compressor.flush()
+
+
+def precompressed_static(serve_path, st, encoding):
+    """Path of a compressed copy of a static file, written the first time that version is asked for"""
+    key = f'{os.path.abspath(serve_path)}:{st.st_size}:{st.st_mtime_ns}'
+    target = os.path.join(CACHE_DIR, 'static', f'{hashlib.md5(key.encode("utf-8")).hexdigest()}.{encoding}')
+    if not os.path.exists(target):
+        with open(serve_path, 'rb') as f:
+            data = compress_body(f.read(), encoding, level=9)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with atomic_write(target) as out:
+            out.write(data)
+    return target
+
+
+# Changes whenever this file does, so pages and API responses rendered by older code are not reused
+with open(__file__, 'rb') as _source:
+    CODE_VERSION = hashlib.md5(_source.read()).hexdigest()[:12]
+
+# Cache-Control for responses that may change under the same URL (the browser revalidates them)
+REVALIDATE = 'no-cache'
+# Cache-Control for media inside an export, which only changes if the ZIP is replaced
+MEDIA_CACHE_CONTROL = 'private, max-age=3600'
+
+
+def file_etag(st):
+    """Validator for a file on disk, from its size and modification time"""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def content_etag(*parts):
+    """Validator for a response fully determined by parts (e.g. a chat hash and page parameters)"""
+    key = json.dumps([CODE_VERSION] + list(parts), ensure_ascii=False)
+    return '"' + hashlib.md5(key.encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def request_is_fresh(headers, etag, last_modified=None):
+    """Whether the client's cached copy is current, per If-None-Match or else If-Modified-Since"""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        # Weak comparison (RFC 7232 section 3.2): W/"x" matches "x"
+        return '*' in tags or etag in (t[2:] if t.startswith('W/') else t for t in tags)
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError, IndexError):
+            return False
+        return int(last_modified) <= since.timestamp()
+    return False
+
+
+def parse_message_filters(query):
+    """The sender, type and date filters of an /api/messages query string, as filter_messages() arguments
+
+    sender and type may be repeated (any of them matches); from and to are
+    inclusive dates in any form parse_jump_date() accepts. Raises ValueError
+    for unknown types and malformed dates.
+    """
+    senders = tuple(sorted(set(v for v in query.get('sender', []) if v)))
+    types = tuple(sorted(set(v for v in query.get('type', []) if v)))
+    for t in types:
+        if t not in MESSAGE_TYPES:
+            raise ValueError(f'Unknown message type: {t}')
+    start = end = None
+    if query.get('from', [''])[0]:
+        start = parse_jump_date(query['from'][0])
+        if start is None:
+            raise ValueError(f"Invalid from date: {query['from'][0]}")
+    if query.get('to', [''])[0]:
+        end = parse_jump_date(query['to'][0], end=True)
+        if end is None:
+            raise ValueError(f"Invalid to date: {query['to'][0]}")
+    return {'senders': senders, 'types': types, 'start': start, 'end': end}
+
+
+def parse_search_mode(query, search_query):
+    """The mode and typo allowance (mode=, distance=) of a search request, as (mode, max_distance)
+
+    Raises ValueError for an unknown mode, a bad distance or an invalid regular expression.
+    """
+    mode = query.get('mode', ['substring'])[0] or 'substring'
+    if mode not in SEARCH_MODES:
+        raise ValueError(f'Unknown search mode: {mode}')
+    max_distance = 0
+    if mode == 'fuzzy':
+        distance = query.get('distance', [''])[0]
+        if distance:
+            if not distance.isdigit():
+                raise ValueError(f'Invalid distance: {distance}')
+            max_distance = min(int(distance), FUZZY_MAX_DISTANCE, len(search_query) // 2)
+        else:
+            max_distance = fuzzy_max_distance(search_query)
+    if mode == 'regex' and search_query:
+        try:
+            pattern_matcher(mode, search_query)
+        except re.error as e:
+            raise ValueError(f'Invalid regular expression: {e}')
+    return mode, max_distance
+
+
+# Exact paths reported as their own endpoint in the metrics; anything else is grouped
+METRIC_ENDPOINTS = ('/', '/view', '/api/messages', '/api/debug', '/api/find', '/api/debug_message',
+                    '/api/stats', '/api/jump', '/api/metrics', '/api/search_all', '/api/cache')
+
+# cProfile can only run one profile at a time
+_profiler_lock = threading.Lock()
+
+
+def request_endpoint(path):
+    """Label a request path for the metrics without creating one series per file"""
+    if path in METRIC_ENDPOINTS:
+        return path
+    for prefix in ('/static/', '/exports/'):
+        if path.startswith(prefix):
+            return prefix
+    return 'other'
+
+
 class Handler(BaseHTTPRequestHandler):
+    # While a ?profile=1 request runs, the response is written here instead of to the socket
+    profile_buffer = None
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
     def add_cors_headers(self):
         """Add CORS headers for the debug endpoint to work from dev tools"""
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -331,7 +2878,213 @@ class Handler(BaseHTTPRequestHandler):
         }
         return f"window.chatConfig = {json.dumps(js_vars)};"
 
+    def send_cache_headers(self, etag, last_modified=None, cache_control=REVALIDATE):
+        self.send_header('ETag', etag)
+        if last_modified is not None:
+            self.send_header('Last-Modified', email.utils.formatdate(last_modified, usegmt=True))
+        if cache_control:
+            self.send_header('Cache-Control', cache_control)
+
+    def not_modified(self, etag, last_modified=None, cache_control=REVALIDATE):
+        """Answer 304 if the client already has this version; return whether it did"""
+        if not request_is_fresh(self.headers, etag, last_modified):
+            return False
+        self.send_response(304)
+        self.send_cache_headers(etag, last_modified, cache_control)
+        self.end_headers()
+        return True
+
+    def send_body(self, body, content_type, etag=None):
+        """Finish the headers and send body, compressed when the client accepts it and it is worth it"""
+        self.send_header('Content-type', content_type)
+        self.send_header('Vary', 'Accept-Encoding')
+        encoding = None
+        if len(body) >= COMPRESS_MIN_BYTES:
+            encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+        if encoding:
+            body = compress_body(body, encoding)
+            self.send_header('Content-Encoding', encoding)
+            if etag:
+                etag = 'W/' + etag  # same content as the uncompressed response, different bytes
+        if etag:
+            self.send_cache_headers(etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_static_file(self, serve_path, content_type=None):
+        """Send a static file, as its stored compressed copy if the client accepts one"""
+        encoding = None
+        if content_type and content_type.startswith(COMPRESSIBLE_TYPES) and 'Range' not in self.headers:
+            encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+        if encoding is None:
+            self.send_file(serve_path, content_type)
+            return
+        st = os.stat(serve_path)
+        etag = file_etag(st)
+        if self.not_modified(etag, st.st_mtime):
+            return
+        with open(precompressed_static(serve_path, st, encoding), 'rb') as f:
+            self.send_stream(f, 0, os.fstat(f.fileno()).st_size, content_type,
+                             ('W/' + etag, st.st_mtime, REVALIDATE), encoding)
+
+    def send_file(self, serve_path, content_type=None, cache_control=REVALIDATE):
+        """Send a file, or the single byte range the client asked for, without reading it into memory"""
+        st = os.stat(serve_path)
+        etag = file_etag(st)
+        if self.not_modified(etag, st.st_mtime, cache_control):
+            return
+        with open(serve_path, 'rb') as f:
+            self.send_stream(f, 0, os.fstat(f.fileno()).st_size, content_type,
+                             (etag, st.st_mtime, cache_control))
+
+    def send_stream(self, f, base, size, content_type=None, validators=None, encoding=None):
+        """Send size bytes of f starting at offset base, honouring a Range header
+
+        validators is an optional (etag, last_modified, cache_control) triple sent with the response;
+        encoding is the Content-Encoding of f's bytes, if they are compressed.
+        """
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if if_range and (validators is None or if_range.strip() != validators[0]):
+            range_header = None  # the client's partial copy is of another version: send it all
+        try:
+            byte_range = parse_byte_range(range_header, size)
+        except RangeNotSatisfiable:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            start, length = 0, size
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        if content_type:
+            self.send_header('Content-type', content_type)
+        if validators is not None:
+            self.send_cache_headers(*validators)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+        try:
+            if _has_fileno(f) and self.profile_buffer is None:
+                # socket.sendfile() uses os.sendfile() where the OS has it and falls back to chunked reads
+                self.connection.sendfile(f, base + start, length)
+            else:
+                # e.g. a compressed ZIP member, which can only be decompressed and copied
+                f.seek(base + start)
+                while length > 0:
+                    chunk = f.read(min(length, 256 * 1024))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    length -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the browser dropped the connection, e.g. a <video> seeking elsewhere
+
+    def send_export_media(self, zip_path, rel_path):
+        """Serve a chat's media file from its extraction if present, otherwise from inside the ZIP"""
+        try:
+            members = get_zip_members(zip_path)
+            info = members.get(rel_path)
+            if info is None:
+                self.send_error(404)
+                return
+            content_type = media_content_type(rel_path)
+            zip_hash = get_zip_hash(zip_path)
+            # The same member of the same export never changes, wherever it is served from
+            validators = (content_etag(zip_hash, info.filename, info.CRC, info.file_size),
+                          os.path.getmtime(zip_path), MEDIA_CACHE_CONTROL)
+            if self.not_modified(*validators):
+                return
+            extracted = extracted_path(zip_hash, info.filename)
+            with CACHE_MANAGER.pinned(zip_hash):
+                if EXTRACT_MODE == 'lazy' and not os.path.isfile(extracted):
+                    extracted = extract_member(zip_path, zip_hash, info.filename)
+                if os.path.isfile(extracted):
+                    with open(extracted, 'rb') as f:
+                        self.send_stream(f, 0, info.file_size, content_type, validators)
+                    return
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                # Stored members are plain byte ranges of the ZIP: stream them like any other file
+                with open(zip_path, 'rb') as f:
+                    self.send_stream(f, members.data_offset(info), info.file_size, content_type, validators)
+            else:
+                with zipfile.ZipFile(zip_path, 'r') as zf, zf.open(info) as f:
+                    self.send_stream(f, 0, info.file_size, content_type, validators)
+        except (zipfile.BadZipFile, FileNotFoundError):
+            self.send_error(404)
+
     def do_GET(self):
+        """Answer the request, recording its latency and profiling it when asked to or sampled"""
+        url = urlparse(self.path)
+        endpoint = request_endpoint(url.path)
+        profile_requested = parse_qs(url.query).get('profile', [''])[0] == '1'
+        sampled = not profile_requested and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+        self._status = None
+        start = time.perf_counter()
+        try:
+            if profile_requested:
+                self.send_profile()
+            elif sampled and _profiler_lock.acquire(blocking=False):
+                # A sampled request that finds the profiler busy is simply served unprofiled
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(self.route_get)
+                finally:
+                    _profiler_lock.release()
+                self.save_profile(profiler, endpoint)
+            else:
+                self.route_get()
+        finally:
+            elapsed = time.perf_counter() - start
+            METRICS.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+            METRICS.inc('http_requests_total', endpoint=endpoint, status=self._status or 'error')
+
+    def send_profile(self):
+        """Run the request under cProfile and answer with the profile instead of the response"""
+        if not _profiler_lock.acquire(timeout=30):
+            self.send_error(503, "Another request is being profiled")
+            return
+        profiler = cProfile.Profile()
+        wfile, self.profile_buffer = self.wfile, io.BytesIO()
+        self.wfile = self.profile_buffer
+        try:
+            profiler.runcall(self.route_get)
+        finally:
+            _profiler_lock.release()
+            self.wfile = wfile
+            captured, self.profile_buffer = self.profile_buffer, None
+        status = self._status
+
+        out = io.StringIO()
+        out.write(f'{self.path}: status {status}, {len(captured.getvalue())} response bytes\n\n')
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(50)
+        self.send_response(200)
+        self.send_body(out.getvalue().encode('utf-8'), 'text/plain; charset=utf-8')
+
+    def save_profile(self, profiler, endpoint):
+        """Keep a sampled request's profile in PROFILE_DIR for later inspection with pstats"""
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = endpoint.strip('/').replace('/', '_') or 'root'
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f'{stamp}-{name}-{threading.get_ident()}.prof'))
+        except OSError:
+            pass  # profiling must never break serving
+
+    def route_get(self):
         url = urlparse(self.path)
         path = url.path
         query = parse_qs(url.query)
@@ -339,9 +3092,7 @@ class Handler(BaseHTTPRequestHandler):
         if path == '/':
             zip_files = get_zip_files()
             self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(render_file_selector(zip_files).encode('utf-8'))
+            self.send_body(render_file_selector(zip_files).encode('utf-8'), 'text/html')
 
         elif path == '/view':
             file_name = query.get('file', [None])[0]
@@ -356,16 +3107,25 @@ class Handler(BaseHTTPRequestHandler):
                     self.send_error(404, "File not found")
                     return
 
-                messages = extract_and_parse(zip_path)
-                total = len(messages)
-                display_name = os.path.splitext(file_name)[0].replace('_', ' ')
                 page = int(query.get('page', [0])[0])
                 search_query = query.get('q', [''])[0]
+                template_path = os.path.join(BASE_DIR, 'templates', 'chat.html')
+                template_mtime = os.path.getmtime(template_path) if os.path.exists(template_path) else None
+                etag = content_etag('view', get_zip_hash(zip_path), file_name, page, search_query,
+                                    BATCH_SIZE, template_mtime)
+                if self.not_modified(etag):
+                    return
+
+                # Render as soon as the first page exists; the rest keeps parsing in the background
+                chat = load_chat(zip_path, wait=False)
+                total = chat.wait(BATCH_SIZE, timeout=INGEST_PAGE_WAIT_SECONDS)
+                complete = chat.complete
+                display_name = os.path.splitext(file_name)[0].replace('_', ' ')
 
                 self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(render_chat_page(display_name, file_name, total, page, search_query).encode('utf-8'))
+                # The page embeds the message count, which only settles once parsing ends
+                self.send_body(render_chat_page(display_name, file_name, total, page, search_query).encode('utf-8'),
+                               'text/html', etag if complete else None)
             except Exception as e:
                 self.send_error(500, str(e))
 
@@ -378,67 +3138,133 @@ class Handler(BaseHTTPRequestHandler):
             try:
                 file_name = urllib.parse.unquote(file_name)
                 zip_path = os.path.join(EXPORTS_DIR, file_name)
-                messages = extract_and_parse(zip_path)
-
                 page = int(query.get('page', [0])[0])
                 search_query = query.get('query', [''])[0]
                 batch_size = int(query.get('batch_size', [BATCH_SIZE])[0])
+                query_clean = search_query.strip()
+                try:
+                    filters = parse_message_filters(query)
+                    search_mode, max_distance = parse_search_mode(query, query_clean)
+                except ValueError as e:
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+                    return
+                filtered = any(filters.values())
+                filter_key = tuple(filters.values())
+                if search_mode != 'substring':
+                    filter_key += (search_mode, max_distance)
+
+                # Only answers for fully parsed chats carry this tag, so a match means the client's
+                # copy is still exactly what we would render: skip loading the chat at all
+                etag = content_etag('messages', get_zip_hash(zip_path), file_name, page, search_query, batch_size,
+                                    filter_key)
+                if self.not_modified(etag):
+                    return
 
-                # Collect all unique senders for dropdown
-                all_senders = set()
-                for msg in messages:
-                    if not msg.get('is_system', False):
-                        all_senders.add(msg['sender'])
-                senders_list = sorted(all_senders)
-
-                if search_query.strip():
-                    query_clean = search_query.strip()
-                    match_indices = []
-                    for i, msg in enumerate(messages):
-                        text_content = (msg.get('text', '') + ' ' + msg.get('sender', '')).lower()
-                        if query_clean.lower() in text_content:
-                            match_indices.append(i)
+                chat = load_chat(zip_path, wait=False)
+
+                chat.wait((page + 1) * batch_size, timeout=INGEST_PAGE_WAIT_SECONDS)
+                # Read the flag before the messages so a finished parse is never reported early
+                ingesting = not chat.complete
+                messages = chat.messages
+                available = len(messages)
+
+                senders_list = chat.senders()
+
+                # Regex and fuzzy searches stop once they have the matches this page needs
+                partial = False
+                # Pages of a fully parsed chat never change, so they are rendered once and reused
+                fragment_key = (chat.zip_hash, file_name, page, batch_size, query_clean, filter_key)
+                cached = None if ingesting else FRAGMENT_CACHE.get(fragment_key)
+                if cached is not None:
+                    html, total_matches = cached
+
+                elif filtered and not query_clean:
+                    # Only the messages passing the filters, resolved through the posting lists
+                    match_indices = chat.filter_messages(**filters)
+                    if ingesting:
+                        match_indices = [i for i in match_indices if i < available]
+                    total_matches = len(match_indices)
+                    start = page * batch_size
+                    end = start + batch_size
+                    if ingesting and len(match_indices) < end:
+                        # As below: hold back a page that later messages could still add to
+                        end = start
+                    batch = [message_view(messages, i) for i in match_indices[start:end]]
+                    html = render_message_html_with_highlight(batch, "", file_name)
+
+                elif query_clean:
+                    if search_mode == 'substring':
+                        match_indices = chat.find_matches(query_clean)
+                        if filtered:
+                            match_indices = intersect_sorted([match_indices, chat.filter_messages(**filters)])
+                    else:
+                        # Each match brings at least one message into the context list, and later matches
+                        # only add messages after it, so the first (page + 1) * batch_size matches settle
+                        # this page; one more tells whether there is a next one
+                        wanted = needed = (page + 1) * batch_size + 1
+                        while True:
+                            match_indices, done = chat.find_pattern_matches(search_mode, query_clean, needed,
+                                                                            max_distance)
+                            if filtered:
+                                match_indices = intersect_sorted([match_indices, chat.filter_messages(**filters)])
+                            if done or len(match_indices) >= wanted:
+                                break
+                            needed *= 2
+                        partial = not done
+                    if ingesting:
+                        match_indices = [i for i in match_indices if i < available]
 
                     context_indices = set()
                     for i in match_indices:
-                        for j in range(max(0, i - 2), min(len(messages), i + 3)):
+                        for j in range(max(0, i - 2), min(available, i + 3)):
                             context_indices.add(j)
                     context_indices = sorted(context_indices)
-
-                    enriched = []
-                    for idx in context_indices:
-                        msg = messages[idx].copy()
-                        msg['_is_match'] = (idx in match_indices)
-                        msg['_index'] = idx
-                        enriched.append(msg)
+                    match_set = set(match_indices)
 
                     total_matches = len(match_indices)
                     start = page * batch_size
                     end = start + batch_size
-                    batch = enriched[start:end]
-                    html = render_message_html_with_highlight(batch, query_clean)
+                    if ingesting and len(context_indices) < end:
+                        # Not a full page yet: more matches may still arrive, so send nothing and let
+                        # the client ask again rather than keep a page missing its later matches
+                        end = start
+                    batch = [message_view(messages, idx, idx in match_set) for idx in context_indices[start:end]]
+                    html = render_message_html_with_highlight(batch, query_clean, file_name)
 
                 else:
-                    total_matches = len(messages)
+                    total_matches = available
                     start = page * batch_size
                     end = start + batch_size
+                    if ingesting and end > available:
+                        # Don't hand out a partial page: the client would never ask for the rest of it
+                        end = start
                     # include global indices for each message so the client can link back to them
-                    batch = []
-                    for i in range(start, min(end, len(messages))):
-                        m = messages[i].copy()
-                        m['_index'] = i
-                        batch.append(m)
-                    html = render_message_html_with_highlight(batch, "")
+                    batch = [message_view(messages, i) for i in range(start, min(end, available))]
+                    html = render_message_html_with_highlight(batch, "", file_name)
 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({
+                if cached is None and not ingesting and not partial:
+                    FRAGMENT_CACHE.put(fragment_key, (html, total_matches), html)
+
+                response = {
                     'html': html,
                     'total_matches': total_matches,
-                    'senders': senders_list
-                }).encode('utf-8'))
+                    'senders': senders_list,
+                    'ingesting': ingesting,
+                    'available': available
+                }
+                if search_mode != 'substring':
+                    # total_matches only counts what has been scanned so far while this is set
+                    response['partial'] = partial
+                self.send_response(200)
+                self.send_body(json.dumps(response).encode('utf-8'), 'application/json',
+                               None if ingesting or partial else etag)
 
+            except SearchTimeout as e:
+                self.send_response(503)
+                self.send_body(json.dumps({'error': str(e)}).encode('utf-8'), 'application/json')
             except Exception as e:
                 self.send_response(500)
                 self.send_header('Content-type', 'application/json')
@@ -487,10 +3313,8 @@ class Handler(BaseHTTPRequestHandler):
                 }
 
                 self.send_response(200)
-                self.send_header('Content-type', 'application/json')
                 self.add_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps(debug_info, ensure_ascii=False, indent=2).encode('utf-8'))
+                self.send_body(json.dumps(debug_info, ensure_ascii=False, indent=2).encode('utf-8'), 'application/json')
 
             except Exception as e:
                 self.send_response(500)
@@ -500,7 +3324,7 @@ class Handler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
 
         elif path == '/api/find':
-            # Find first message index that matches the query (simple contains on text+sender)
+            # Find first message index that matches the query (contains on text+sender, or mode=regex/fuzzy)
             file_name = query.get('file', [None])[0]
             q = query.get('q', [''])[0]
             if not file_name:
@@ -513,20 +3337,114 @@ class Handler(BaseHTTPRequestHandler):
             try:
                 file_name = urllib.parse.unquote(file_name)
                 zip_path = os.path.join(EXPORTS_DIR, file_name)
-                messages = extract_and_parse(zip_path)
-                q_clean = q.strip().lower()
-                found = -1
-                if q_clean:
-                    for i, msg in enumerate(messages):
-                        text_content = (msg.get('text', '') + ' ' + msg.get('sender', '')).lower()
-                        if q_clean in text_content:
-                            found = i
-                            break
+                try:
+                    search_mode, max_distance = parse_search_mode(query, q.strip())
+                except ValueError as e:
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+                    return
+                chat = load_chat(zip_path)
+                if search_mode == 'substring':
+                    matches = chat.find_matches(q)
+                elif q.strip():
+                    matches, _ = chat.find_pattern_matches(search_mode, q.strip(), 1, max_distance)
+                else:
+                    matches = []
+                found = matches[0] if matches else -1
 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps({'index': found}).encode('utf-8'))
+            except SearchTimeout as e:
+                self.send_response(503)
+                self.send_body(json.dumps({'error': str(e)}).encode('utf-8'), 'application/json')
+            except Exception as e:
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+
+        elif path == '/api/cache':
+            # Disk used per export, the budget and what the janitor evicted recently
+            self.send_response(200)
+            self.send_body(json.dumps(CACHE_MANAGER.report()).encode('utf-8'), 'application/json')
+
+        elif path == '/api/search_all':
+            # Search every export at once, streaming one JSON line (or server-sent event) per export
+            q = query.get('q', [''])[0].strip()
+            try:
+                if not q:
+                    raise ValueError('No query')
+                search_mode, max_distance = parse_search_mode(query, q)
+                per_file = int(query.get('per_file', [SEARCH_ALL_PER_FILE])[0])
+                limit = int(query.get('limit', [SEARCH_ALL_LIMIT])[0])
+                timeout = float(query.get('timeout', [SEARCH_ALL_TIMEOUT_SECONDS])[0])
+                if per_file < 1 or limit < 1 or not timeout > 0:
+                    raise ValueError('per_file, limit and timeout must be positive')
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+                return
+
+            sse = (query.get('format', [''])[0] == 'sse'
+                   or 'text/event-stream' in self.headers.get('Accept', ''))
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream' if sse else 'application/x-ndjson')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            cancelled = threading.Event()
+            results = search_all_exports(q, search_mode, max_distance, per_file=per_file, limit=limit,
+                                         timeout=timeout, cancelled=cancelled)
+            try:
+                for result in results:
+                    line = json.dumps(result)
+                    self.wfile.write((f'data: {line}\n\n' if sse else line + '\n').encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away: don't start on the exports that are still queued
+                cancelled.set()
+            finally:
+                results.close()
+
+        elif path == '/api/jump':
+            # First message on or after a date (YYYY-MM-DD, YYYY-MM or YYYY) and the page holding it
+            file_name = query.get('file', [None])[0]
+            target = parse_jump_date(query.get('date', [''])[0])
+            if not file_name or target is None:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': 'missing file or invalid date'}).encode('utf-8'))
+                return
+            try:
+                file_name = urllib.parse.unquote(file_name)
+                zip_path = os.path.join(EXPORTS_DIR, file_name)
+                batch_size = int(query.get('batch_size', [BATCH_SIZE])[0])
+                etag = content_etag('jump', get_zip_hash(zip_path), target, batch_size)
+                if self.not_modified(etag):
+                    return
+                chat = load_chat(zip_path, wait=False)
+                chat.wait(0)
+                ingesting = not chat.complete
+                index = chat.first_on_or_after(target)
+                if index is None and ingesting:
+                    # The date may just not be parsed yet: give the parse a moment before answering
+                    # (the client asks again for as long as ingesting is set)
+                    chat.wait(timeout=INGEST_PAGE_WAIT_SECONDS)
+                    ingesting = not chat.complete
+                    index = chat.first_on_or_after(target)
+                result = {'index': -1, 'page': -1, 'timestamp': None, 'ingesting': ingesting}
+                if index is not None:
+                    result.update(index=index, page=index // batch_size,
+                                  timestamp=chat.messages[index].get('timestamp'))
+                self.send_response(200)
+                self.send_body(json.dumps(result, ensure_ascii=False).encode('utf-8'), 'application/json',
+                               None if ingesting else etag)
             except Exception as e:
                 self.send_response(500)
                 self.send_header('Content-type', 'application/json')
@@ -564,18 +3482,49 @@ class Handler(BaseHTTPRequestHandler):
                 self.end_headers()
                 self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
 
+        elif path == '/api/stats':
+            # Message, media and per-sender counts, activity histograms and first/last timestamps
+            file_name = query.get('file', [None])[0]
+            if not file_name:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': 'No file'}).encode('utf-8'))
+                return
+            try:
+                file_name = urllib.parse.unquote(file_name)
+                zip_path = os.path.join(EXPORTS_DIR, file_name)
+                etag = content_etag('stats', get_zip_hash(zip_path))
+                if self.not_modified(etag):
+                    return
+                chat = load_chat(zip_path, wait=False)
+                chat.wait(0)
+                ingesting = not chat.complete
+                stats = chat.stats().to_json()
+                stats['ingesting'] = ingesting
+                self.send_response(200)
+                self.send_body(json.dumps(stats, ensure_ascii=False).encode('utf-8'), 'application/json',
+                               None if ingesting else etag)
+            except Exception as e:
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+
+        elif path == '/api/metrics':
+            self.send_response(200)
+            self.send_body(METRICS.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+
         elif path.startswith('/static/'):
             rel_path = urllib.parse.unquote(path[len('/static/'):])
             serve_path = os.path.join(BASE_DIR, 'static', rel_path)
-            if os.path.exists(serve_path):
-                self.send_response(200)
+            if os.path.isfile(serve_path):
+                content_type = None
                 if serve_path.endswith('.js'):
-                    self.send_header('Content-type', 'application/javascript')
+                    content_type = 'application/javascript'
                 elif serve_path.endswith('.css'):
-                    self.send_header('Content-type', 'text/css')
-                self.end_headers()
-                with open(serve_path, 'rb') as f:
-                    self.wfile.write(f.read())
+                    content_type = 'text/css'
+                self.send_static_file(serve_path, content_type)
                 return
             else:
                 self.send_error(404)
@@ -584,6 +3533,13 @@ class Handler(BaseHTTPRequestHandler):
         elif path.startswith('/exports/'):
             rel_path = urllib.parse.unquote(path[len('/exports/'):])
 
+            file_name = query.get('file', [None])[0]
+            if file_name:
+                zip_path = os.path.join(EXPORTS_DIR, urllib.parse.unquote(file_name))
+                if os.path.isfile(zip_path):
+                    self.send_export_media(zip_path, rel_path)
+                    return
+
             # Try to serve from the exports folder first (user may have placed media there)
             candidate = os.path.join(EXPORTS_DIR, rel_path)
             if os.path.exists(candidate):
@@ -602,69 +3558,374 @@ class Handler(BaseHTTPRequestHandler):
                     if serve_path:
                         break
 
-            if not serve_path or not os.path.exists(serve_path):
+            if not serve_path or not os.path.isfile(serve_path):
                 self.send_error(404)
                 return
 
-            # determine content-type
-            self.send_response(200)
-            ext = os.path.splitext(serve_path)[1].lower()
-            ct = 'application/octet-stream'
-            if ext in ('.jpg', '.jpeg'):
-                ct = 'image/jpeg'
-            elif ext == '.png':
-                ct = 'image/png'
-            elif ext == '.gif':
-                ct = 'image/gif'
-            elif ext == '.webp':
-                ct = 'image/webp'
-            elif ext in ('.mp4', '.mov', '.3gp'):
-                ct = 'video/mp4'
-            elif ext in ('.mp3', '.opus'):
-                ct = 'audio/mpeg'
-            self.send_header('Content-type', ct)
-            self.end_headers()
-            with open(serve_path, 'rb') as f:
-                self.wfile.write(f.read())
+            self.send_file(serve_path, media_content_type(serve_path), MEDIA_CACHE_CONTROL)
 
         else:
             self.send_error(404)
 
 
+# ----------------------------
+# Cache eviction
+# ----------------------------
+
+# Everything cached for one export is named after its ZIP hash: <hash>.msgs, <hash>.search.idx,
+# extract_<hash>/, and the temporary and partial copies written beside them
+_CACHE_OWNER_RE = re.compile(r'^(?:extract_)?([0-9a-f]{32})(?:\.|$)')
+_TRASH_PREFIX = '.evicted-'
+
+
+def _path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class CacheManager:
+    """Keeps what .cache/ holds for the exports under a byte budget, evicting least recently used first
+
+    An export's parsed messages, indexes, statistics, media listing and extracted
+    files are evicted together. Exports that are held are never touched: every
+    LoadedChat holds its export while it is referenced (from the chat store, its
+    ingestion or a request), and requests serving media pin theirs. A held export
+    also carries a shared lock on .cache/<hash>.use.lock, so the janitor leaves
+    exports alone that another server process (see --workers) is using. Access
+    times are kept in memory and written to the files' mtimes by the next sweep,
+    so the order survives restarts; touch() also writes them to the cached
+    messages now and then, for the janitor in another server process.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, interval=CACHE_JANITOR_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.evictions = deque(maxlen=100)
+        # Reentrant: release() runs from weakref finalizers, which may fire on any thread at any time
+        self._lock = threading.RLock()
+        self._touched = {}
+        self._written = {}
+        self._pins = {}
+        self._use_locks = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def touch(self, zip_hash):
+        now = time.time()
+        with self._lock:
+            self._touched[zip_hash] = now
+            if now - self._written.get(zip_hash, 0) < CACHE_TOUCH_WRITE_INTERVAL_SECONDS:
+                return
+            self._written[zip_hash] = now
+        for ext in ('msgs', 'json'):
+            with contextlib.suppress(OSError):
+                os.utime(os.path.join(CACHE_DIR, f'{zip_hash}.{ext}'), (now, now))
+
+    def hold(self, zip_hash):
+        """Keep an export's cached files from being evicted until a matching release()"""
+        with self._lock:
+            self._pins[zip_hash] = self._pins.get(zip_hash, 0) + 1
+            if self._pins[zip_hash] == 1:
+                self._use_locks[zip_hash] = lock_export_file(zip_hash, 'use', shared=True)
+        self.touch(zip_hash)
+
+    def release(self, zip_hash):
+        with self._lock:
+            self._pins[zip_hash] -= 1
+            if not self._pins[zip_hash]:
+                del self._pins[zip_hash]
+                self._use_locks.pop(zip_hash).close()
+
+    @contextlib.contextmanager
+    def pinned(self, zip_hash):
+        """Hold an export's cached files while the block runs"""
+        self.hold(zip_hash)
+        try:
+            yield
+        finally:
+            self.release(zip_hash)
+
+    def in_use(self, zip_hash):
+        with self._lock:
+            return zip_hash in self._pins
+
+    def entries(self):
+        """Cached paths by the ZIP hash they belong to"""
+        owners = {}
+        for name in os.listdir(CACHE_DIR):
+            match = _CACHE_OWNER_RE.match(name)
+            # Lock files go with an eviction, once it holds them
+            if match and not name.endswith('.lock'):
+                owners.setdefault(match.group(1), []).append(os.path.join(CACHE_DIR, name))
+        return owners
+
+    def usage(self):
+        """[zip_hash, paths, bytes, last access] of every cached export, least recently used first"""
+        with self._lock:
+            touched = dict(self._touched)
+        usage = []
+        for zip_hash, paths in self.entries().items():
+            size = last_access = 0
+            for path in paths:
+                with contextlib.suppress(OSError):
+                    size += _path_size(path)
+                    last_access = max(last_access, os.path.getmtime(path))
+            usage.append([zip_hash, paths, size, max(last_access, touched.get(zip_hash, 0))])
+        usage.sort(key=lambda u: u[3])
+        return usage
+
+    def sweep(self):
+        """Record access times, then evict until the cache fits in max_bytes; return what was evicted"""
+        for name in os.listdir(CACHE_DIR):
+            if name.startswith(_TRASH_PREFIX):
+                # Left behind by an eviction that was interrupted
+                self._remove(os.path.join(CACHE_DIR, name))
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            # Everything touched is written below
+            self._written = {}
+        owners = self.entries()
+        for name in os.listdir(CACHE_DIR):
+            match = _CACHE_OWNER_RE.match(name)
+            if match and name.endswith('.lock') and match.group(1) not in owners:
+                # Only lock files left: evicting nothing removes them
+                self._evict(match.group(1), [])
+        for zip_hash, atime in touched.items():
+            for path in owners.get(zip_hash, ()):
+                with contextlib.suppress(OSError):
+                    os.utime(path, (atime, atime))
+
+        usage = self.usage()
+        total = sum(u[2] for u in usage)
+        evicted = []
+        for zip_hash, paths, size, last_access in usage:
+            if total <= self.max_bytes:
+                break
+            if self._evict(zip_hash, paths):
+                total -= size
+                record = {'hash': zip_hash, 'bytes': size, 'last_access': last_access, 'evicted_at': time.time()}
+                evicted.append(record)
+                self.evictions.append(record)
+                METRICS.inc('cache_evictions_total')
+                METRICS.inc('cache_evicted_bytes_total', size)
+        return evicted
+
+    def _evict(self, zip_hash, paths):
+        # The chat lock is held while a chat is loaded from or parsed into the cache
+        lock = keyed_lock(('chat', zip_hash))
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if zip_hash in self._pins:
+                    return False
+                use_lock = lock_export_file(zip_hash, 'use', blocking=False)
+                if use_lock is None:
+                    # Held by another server process
+                    return False
+                # Renaming is quick, so holders wait for it rather than for the deletion
+                trash = []
+                try:
+                    for path in paths:
+                        target = os.path.join(CACHE_DIR, f'{_TRASH_PREFIX}{os.path.basename(path)}')
+                        with contextlib.suppress(OSError):
+                            os.replace(path, target)
+                            trash.append(target)
+                    # Ingestion holds the export first, so with the use lock held nobody holds or awaits
+                    # the ingest lock; lock_export_file() moves anyone waiting on a deleted file over
+                    for kind in ('ingest', 'use'):
+                        with contextlib.suppress(OSError):
+                            os.remove(os.path.join(CACHE_DIR, f'{zip_hash}.{kind}.lock'))
+                finally:
+                    use_lock.close()
+        finally:
+            lock.release()
+        for path in trash:
+            self._remove(path)
+        return True
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def report(self):
+        """What /api/cache shows: the budget, per-export usage and the latest evictions"""
+        usage = self.usage()
+        return {
+            'max_bytes': self.max_bytes,
+            'used_bytes': sum(u[2] for u in usage),
+            'exports': [{'hash': zip_hash, 'bytes': size, 'last_access': last_access, 'in_use': self.in_use(zip_hash)}
+                        for zip_hash, _, size, last_access in reversed(usage)],
+            'evictions': list(self.evictions),
+        }
+
+    def start(self):
+        """Sweep now and then every interval seconds on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cache-janitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Cache sweep failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+CACHE_MANAGER = CacheManager()
+
+
 # ----------------------------
 # Main Entry Point
 # ----------------------------
 
-def cleanup_old_extractions(max_age_days=7):
-    """Clean up extraction directories older than max_age_days"""
-    current_time = datetime.now()
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    """HTTPServer that handles each request on its own thread"""
+    daemon_threads = True
+
+    def get_request(self):
+        conn, addr = super().get_request()
+        # On BSD and macOS a connection inherits O_NONBLOCK from the listening socket (see serve_workers)
+        conn.setblocking(True)
+        return conn, addr
+
+
+def _run_worker(server, slot):
+    """Body of a forked worker process; never returns"""
+    code = 0
+    try:
+        if slot == 0:
+            # One janitor is enough; the use locks keep it away from the other workers' exports
+            CACHE_MANAGER.start()
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"⚠️ Worker {os.getpid()} failed: {e}")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve_workers(server, workers, started=None):
+    """Serve from worker processes forked to share server's listening socket, replacing any that exits
+
+    started is called once the first workers are running. Nothing may have
+    started a thread before this is called: a forked child only keeps the calling
+    thread, and with it any lock another thread held.
+    """
+    # A worker woken for a connection another one accepted first must not block in accept()
+    server.socket.setblocking(False)
+    children = {}
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            _run_worker(server, slot)
+        children[pid] = (slot, time.monotonic())
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    for slot in range(workers):
+        spawn(slot)
+    if started is not None:
+        started()
     try:
-        for item in os.listdir(CACHE_DIR):
-            if item.startswith('extract_'):
-                item_path = os.path.join(CACHE_DIR, item)
-                if os.path.isdir(item_path):
-                    # Check the directory's last modification time
-                    mtime = datetime.fromtimestamp(os.path.getmtime(item_path))
-                    age_days = (current_time - mtime).days
-                    if age_days > max_age_days:
-                        try:
-                            shutil.rmtree(item_path)
-                        except Exception:
-                            pass
-    except Exception:
-        pass  # Ignore cleanup errors
-
-def main():
-    port = 8000
-    server = HTTPServer(('localhost', port), Handler)
-    url = f'http://localhost:{port}'
+        while True:
+            pid, status = os.wait()
+            if pid not in children:
+                continue
+            slot, spawned = children.pop(pid)
+            print(f"⚠️ Worker {pid} exited (status {status}); starting a new one")
+            if time.monotonic() - spawned < WORKER_RESTART_DELAY_SECONDS:
+                # Dying straight after starting: don't spin
+                time.sleep(WORKER_RESTART_DELAY_SECONDS)
+            spawn(slot)
+    except KeyboardInterrupt:
+        for pid in children:
+            with contextlib.suppress(OSError):
+                os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            with contextlib.suppress(OSError):
+                os.waitpid(pid, 0)
+        raise
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Browse WhatsApp export ZIPs in the browser.')
+    parser.add_argument('--host', default='localhost', help='interface to bind (default: localhost)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--single-threaded', action='store_true',
+                        help='handle one request at a time instead of one thread per request')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='serve from this many processes sharing the port, to use more than one core '
+                             '(not on Windows; default: %(default)s)')
+    parser.add_argument('--no-browser', action='store_true', help='do not open a browser window')
+    parser.add_argument('--extract-mode', choices=('zip', 'lazy', 'full'), default=EXTRACT_MODE,
+                        help='read media straight from the ZIP (zip), extract each file on first use (lazy) '
+                             'or extract whole archives up front (full); default: %(default)s')
+    parser.add_argument('--cache-max-mb', type=float, default=CACHE_MAX_BYTES / 1024 ** 2,
+                        help='disk space for parsed chats, indexes and extracted media before the least '
+                             'recently used exports are evicted (default: %(default)d)')
+    parser.add_argument('--profile-sample-rate', type=float, default=PROFILE_SAMPLE_RATE,
+                        help='fraction of requests to profile, saving each profile to .cache/profiles/ '
+                             '(default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global EXTRACT_MODE, PROFILE_SAMPLE_RATE, SEARCH_WORKERS, PARSE_WORKERS
+    args = parse_args(argv)
+    EXTRACT_MODE = args.extract_mode
+    PROFILE_SAMPLE_RATE = args.profile_sample_rate
+    CACHE_MANAGER.max_bytes = int(args.cache_max_mb * 1024 ** 2)
+    workers = args.workers
+    if workers > 1 and not hasattr(os, 'fork'):
+        print("⚠️ --workers needs os.fork(), which this platform lacks; serving from one process")
+        workers = 1
+    server_class = HTTPServer if args.single_threaded else ThreadingServer
+    server = server_class((args.host, args.port), Handler)
+    port = server.server_address[1]
+    url = f'http://{args.host}:{port}'
     print(f"✅ WhatsApp Viewer running at {url}")
     print(f"📁 Place your WhatsApp .zip exports in: {os.path.abspath(EXPORTS_DIR)}")
+
+    if workers > 1:
+        # Every worker gets its own search and parse pools; together they use each core about once
+        SEARCH_WORKERS = max(1, SEARCH_WORKERS // workers)
+        PARSE_WORKERS = max(1, PARSE_WORKERS // workers)
+        print(f"🧵 Serving from {workers} worker processes")
+        try:
+            serve_workers(server, workers, None if args.no_browser else lambda: webbrowser.open(url))
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+            server.server_close()
+        return
+
+    # Evict least recently used exports now and every CACHE_JANITOR_INTERVAL_SECONDS
+    CACHE_MANAGER.start()
     
-    # Clean up old extracted files on startup
-    cleanup_old_extractions()
-    
-    webbrowser.open(url)
+    if not args.no_browser:
+        webbrowser.open(url)
 
     try:
         server.serve_forever()